@@ -0,0 +1,136 @@
+"""
+Admission control for statement uploads.
+
+Before an upload is read, check_capacity turns it away with 503 when the job backlog is
+already too large, or with 429 when the user has too many jobs in progress. Once the file is
+saved, its cost (pages) is estimated and admit queues it, repeating those checks and rejecting
+statements that are too large (413), would overflow the backlog (503), or exceed the user's
+hourly page quota (429) in the same transaction that inserts the job, so simultaneous uploads
+can't all slip under a limit. Every rejection carries a Retry-After estimate. Accepted jobs
+wait in the job queue, and JobRunner starts at most MAX_RUNNING_JOBS at a time across all web
+workers.
+
+Counts come from the jobs database, so every web worker process applies the same limits.
+"""
+import math
+import os
+import time
+
+# Jobs running at once across all web workers (passed to jobs.JobRunner)
+MAX_RUNNING_JOBS = int(os.environ.get("MAX_RUNNING_JOBS", "2"))
+# Pages queued or running across all users beyond which uploads are turned away
+MAX_ACTIVE_PAGES = int(os.environ.get("MAX_ACTIVE_PAGES", "500"))
+# Largest statement accepted, in pages
+MAX_JOB_PAGES = int(os.environ.get("MAX_JOB_PAGES", "200"))
+# Per-user quotas: jobs queued or running, and pages submitted per QUOTA_WINDOW_SECONDS
+USER_MAX_ACTIVE_JOBS = int(os.environ.get("USER_MAX_ACTIVE_JOBS", "3"))
+USER_MAX_WINDOW_PAGES = int(os.environ.get("USER_MAX_WINDOW_PAGES", "300"))
+QUOTA_WINDOW_SECONDS = 3600
+
+# Processing time per page assumed until jobs have finished to measure it
+DEFAULT_SECONDS_PER_PAGE = 10.0
+# Pages assumed per megabyte when the page count can't be read
+PAGES_PER_MB = 10
+
+class AdmissionError(Exception):
+    """An upload that can't be accepted now; status is the HTTP status, retry_after in seconds (or None)."""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+def estimate_pages(file_path):
+    """
+    Estimated cost of a statement in pages: the PDF's page count, 1 for an image, or a guess from
+    the file size when the PDF can't be read.
+    """
+    if not file_path.lower().endswith('.pdf'):
+        return 1
+    try:
+        from ocr_2 import count_pages
+        return max(1, count_pages(file_path))
+    except Exception:
+        return max(1, math.ceil(os.path.getsize(file_path) / (1024 * 1024) * PAGES_PER_MB))
+
+def _retry_after(pages, load):
+    # Time for the running jobs to work through `pages` pages, at the recent speed
+    seconds_per_page = load['seconds_per_page'] or DEFAULT_SECONDS_PER_PAGE
+    return min(3600, max(1, math.ceil(pages * seconds_per_page / max(1, MAX_RUNNING_JOBS))))
+
+def check_capacity(store, username):
+    """
+    Cheap checks done before the upload is read.
+
+    Args:
+        store (jobs.JobStore): The job database.
+        username (str): Uploading user.
+
+    Returns:
+        dict: The current load (jobs.JobStore.load)
+
+    Raises:
+        AdmissionError: 503 when the backlog is full, 429 when the user has too many jobs in progress
+    """
+    load = store.load(username, QUOTA_WINDOW_SECONDS)
+    _check_active(load)
+    return load
+
+def _check_active(load):
+    if load['active_pages'] >= MAX_ACTIVE_PAGES:
+        raise AdmissionError(503, "The server is busy processing other statements. Please try again later.",
+                             _retry_after(load['active_pages'] - MAX_ACTIVE_PAGES + 1, load))
+    if load['user_active'] >= USER_MAX_ACTIVE_JOBS:
+        raise AdmissionError(429, f"You already have {load['user_active']} statements in progress. "
+                                  "Please wait for one to finish.", _retry_after(load['user_active_pages'], load))
+
+def check_cost(load, pages):
+    """
+    Checks an estimated job cost against the limits.
+
+    Args:
+        load (dict): The current load (jobs.JobStore.load).
+        pages (int): Estimated pages of the new job (see estimate_pages).
+
+    Raises:
+        AdmissionError: 413 when the statement is too large, 503 when it would overflow the
+            backlog, 429 when it would exceed the user's page quota
+    """
+    if pages > MAX_JOB_PAGES:
+        raise AdmissionError(413, f"The statement has {pages} pages; at most {MAX_JOB_PAGES} are accepted.")
+    if load['active_pages'] + pages > MAX_ACTIVE_PAGES:
+        raise AdmissionError(503, "The server is busy processing other statements. Please try again later.",
+                             _retry_after(load['active_pages'] + pages - MAX_ACTIVE_PAGES, load))
+    if load['user_window_pages'] + pages > USER_MAX_WINDOW_PAGES:
+        retry_after = None
+        if load['user_window_start'] is not None:
+            # When the user's oldest job in the window stops counting
+            retry_after = max(1, math.ceil(load['user_window_start'] + QUOTA_WINDOW_SECONDS - time.time()))
+        raise AdmissionError(429, f"Upload limit reached: {USER_MAX_WINDOW_PAGES} pages per hour.", retry_after)
+
+def admit(store, username, filename, file_path, options, pages):
+    """
+    Queues the job if it still fits: every limit is checked again against the load inside the
+    transaction that inserts it, so uploads checked at the same time can't all be admitted.
+
+    Args:
+        store (jobs.JobStore): The job database.
+        username (str): Uploading user.
+        filename (str): Original file name.
+        file_path (str): Where the upload was saved.
+        options (dict): Job options (backend, bank, account).
+        pages (int): Estimated pages of the job (see estimate_pages).
+
+    Returns:
+        str: The new job's id
+
+    Raises:
+        AdmissionError: As check_capacity and check_cost; the job is not created
+    """
+    def check(load):
+        load = load(QUOTA_WINDOW_SECONDS)
+        _check_active(load)
+        check_cost(load, pages)
+
+    return store.create(username, filename, file_path, options, cost=pages, check=check)
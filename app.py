@@ -1,19 +1,68 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, jsonify, abort, Response, stream_with_context, stream_template
+import datetime
+import json
 import os
-import csv
 import re
+import threading
+import time
+import uuid
 from werkzeug.utils import secure_filename
-from ocr_2 import ocr_pdf_to_text
-from model import extract_transactions
+import admission
+import export
+import jobs
+import metrics
+import pipeline
 import post_processing
+import transactions
 
 app = Flask(__name__)
 app.secret_key = "your_secret_key"  # Change this to a secure key
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['ALLOWED_EXTENSIONS'] = {'pdf', 'png', 'jpg', 'jpeg'}
+# Databases live in their own folder, away from the files download_file can serve
+app.config['DATA_FOLDER'] = 'data'
+app.config['JOBS_DB'] = os.path.join(app.config['DATA_FOLDER'], 'jobs.db')
+app.config['JOB_WORKERS'] = 1  # Background pipeline threads per web worker process
+app.config['TRANSACTIONS_DB'] = os.path.join(app.config['DATA_FOLDER'], 'transactions.db')
+# Each open /jobs/<id>/events stream holds a worker thread: it is ended after EVENT_STREAM_SECONDS
+# (the browser reconnects with Last-Event-ID) and a user gets at most EVENT_STREAMS_PER_USER per worker
+app.config['EVENT_STREAM_SECONDS'] = 30
+app.config['EVENT_STREAMS_PER_USER'] = 2
 
-# Ensure upload folder exists
+# Ensure upload and data folders exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['DATA_FOLDER'], exist_ok=True)
+
+def run_ocr_job(job, progress):
+    """Background job handler: runs the whole pipeline for one uploaded statement."""
+    options = job['options']
+    # A retried job starts its row stream over
+    job_store.clear_rows(job['id'])
+    # Per job, not per user: a user's jobs can run at the same time, and each job page downloads its own rows
+    output_file = f"validated_bank_statement_{job['id']}.csv"
+
+    # Rows go straight to the job's row table as they are validated; the page renders from there.
+    # They are also kept in the user's transaction history, which outlives the job's CSV.
+    rows = pipeline.stream_pipeline(job['file_path'], output_file, backend=options.get('backend'),
+                                    bank=options.get('bank'), progress=progress)
+    stored = {}
+    rows = transaction_store.stream_insert(rows, job['username'], options.get('account') or "",
+                                           source=job['id'], stats=stored)
+    row_count = job_store.store_rows(job['id'], rows)
+    return {'row_count': row_count, 'csv_file': output_file, **stored}
+
+# Uploads are processed by background workers; the job table lives in SQLite so queued jobs
+# survive a web worker restart and are picked up by whichever worker is free
+job_store = jobs.JobStore(app.config['JOBS_DB'])
+job_runner = jobs.JobRunner(job_store, run_ocr_job, workers=app.config['JOB_WORKERS'],
+                            max_running=admission.MAX_RUNNING_JOBS)
+# OCR pool workers import the script that started them as __mp_main__ (see ocr_2.OCR_POOL_CONTEXT);
+# only the web process itself runs jobs
+if __name__ != '__mp_main__':
+    job_runner.start()
+
+# Every validated transaction of every upload, deduplicated across overlapping statements
+transaction_store = transactions.TransactionStore(app.config['TRANSACTIONS_DB'])
 
 # Simulated user database (replace with a real database in production)
 # Store user data as a dictionary: {username: {'password': password, 'email': email, 'mobile': mobile}}
@@ -138,11 +187,28 @@ def settings():
             flash('Current password is incorrect')
     return render_template('settings.html', username=session['username'])
 
+def _rejected(error):
+    """Response for an upload turned away by admission control."""
+    if request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'error': error.message})
+    else:
+        flash(error.message)
+        response = app.make_response(render_template('ocr.html', username=session['username']))
+    response.status_code = error.status
+    if error.retry_after is not None:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 @app.route('/ocr', methods=['GET', 'POST'])
 def ocr():
     if 'username' not in session:
         return redirect(url_for('login'))
     if request.method == 'POST':
+        # Checked before request.files reads the upload, so a saturated server answers right away
+        try:
+            admission.check_capacity(job_store, session['username'])
+        except admission.AdmissionError as e:
+            return _rejected(e)
         if 'file' not in request.files:
             flash('No file part')
             return redirect(request.url)
@@ -152,30 +218,208 @@ def ocr():
             return redirect(request.url)
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            # Unique name so a queued job's file isn't overwritten by a later upload with the same name
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex[:8]}_{filename}")
             file.save(file_path)
             try:
-                # Perform OCR
-                text = ocr_pdf_to_text(file_path)
-                # Extract transactions using LLM
-                transactions = extract_transactions(text)
-                # Clean and process the transactions
-                cleaned_lines = post_processing.clean_bank_lines(transactions)
-                cleaned_data = post_processing.clean_bank_statement(cleaned_lines)
-                output_file = post_processing.process_and_validate_bank_statement(cleaned_data, f"validated_bank_statement_{session['username']}.csv")
-                # Read CSV content for display
-                with open(output_file, 'r') as f:
-                    csv_reader = csv.DictReader(f)
-                    validated_data = list(csv_reader)
-                return render_template('ocr.html', username=session['username'], transactions=validated_data, csv_file=output_file)
-            except Exception as e:
-                flash(f'Error processing file: {str(e)}')
-                return redirect(request.url)
+                job_id = admission.admit(job_store, session['username'], filename, file_path, {
+                    'backend': request.form.get('backend'),
+                    'bank': request.form.get('bank'),
+                    'account': request.form.get('account', '').strip(),
+                }, admission.estimate_pages(file_path))
+            except admission.AdmissionError as e:
+                os.remove(file_path)
+                return _rejected(e)
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify({'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
+            return redirect(url_for('job_page', job_id=job_id))
     return render_template('ocr.html', username=session['username'])
 
+def _get_user_job(job_id):
+    job = job_store.get(job_id)
+    if job is None or job['username'] != session['username']:
+        abort(404)
+    return job
+
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    job = _get_user_job(job_id)
+    if job['status'] == 'failed':
+        flash(f"Error processing file: {job['error']}")
+    if job['status'] == 'done':
+        # Rendered while the rows are read from the job store, without loading them all first
+        return stream_template('ocr.html', username=session['username'], job=job,
+                               transactions=job_store.iter_rows(job_id), csv_file=job['result']['csv_file'])
+    return render_template('ocr.html', username=session['username'], job=job)
+
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    job = _get_user_job(job_id)
+    return jsonify({
+        'job_id': job['id'],
+        'filename': job['filename'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'progress': job['progress'],
+        'error': job['error'],
+        'rows': job['result']['row_count'] if job['result'] else None,
+        'metrics': job['metrics'],
+    })
+
+# Open event streams per user in this worker process
+_event_streams = {}
+_event_streams_lock = threading.Lock()
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events: pushes each validated row while the job is still running, then 'done'."""
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    _get_user_job(job_id)
+    last_seq = int(request.headers.get('Last-Event-ID', 0) or 0)
+    username = session['username']
+    with _event_streams_lock:
+        if _event_streams.get(username, 0) >= app.config['EVENT_STREAMS_PER_USER']:
+            # Not an error status: EventSource gives up on those, but retries a stream that just ends
+            return Response("retry: 5000\n\n", mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+        _event_streams[username] = _event_streams.get(username, 0) + 1
+
+    def release():
+        with _event_streams_lock:
+            _event_streams[username] -= 1
+            if not _event_streams[username]:
+                del _event_streams[username]
+
+    def events():
+        seq = last_seq
+        deadline = time.monotonic() + app.config['EVENT_STREAM_SECONDS']
+        while True:
+            for seq, row in job_store.rows_after(job_id, seq):
+                yield f"id: {seq}\nevent: row\ndata: {json.dumps(row)}\n\n"
+            job = job_store.get(job_id)
+            yield f"event: progress\ndata: {json.dumps({'stage': job['stage'], 'progress': job['progress']})}\n\n"
+            if job['status'] in ('done', 'failed'):
+                # Rows stored between the last poll and the status change
+                for seq, row in job_store.rows_after(job_id, seq):
+                    yield f"id: {seq}\nevent: row\ndata: {json.dumps(row)}\n\n"
+                yield f"event: {job['status']}\ndata: {json.dumps({'error': job['error']})}\n\n"
+                return
+            if time.monotonic() >= deadline:
+                # Frees this thread; the browser reconnects right away and continues after the last row id
+                yield "retry: 500\n\n"
+                return
+            time.sleep(0.5)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(release)
+    return response
+
+def _transaction_filters():
+    """account/start/end query arguments shared by the /transactions endpoints; aborts with 400 on bad dates."""
+    account = request.args.get('account')
+    start = request.args.get('start')
+    end = request.args.get('end')
+    for value in (start, end):
+        if value:
+            try:
+                datetime.date.fromisoformat(value)
+            except ValueError:
+                abort(400, description=f"Invalid date {value!r}, expected YYYY-MM-DD")
+    return account, start, end
+
+def _amount_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return post_processing.to_minor_units(value.replace(',', ''))
+    except ValueError:
+        abort(400, description=f"Invalid amount {value!r}")
+
+@app.route('/transactions')
+def transaction_history():
+    """Stored transactions between ?start= and ?end= (YYYY-MM-DD), oldest first; ?after= continues a page."""
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    account, start, end = _transaction_filters()
+    after = request.args.get('after')
+    if after:
+        after_date, _, after_id = after.partition(',')
+        if not after_id.isdigit():
+            abort(400, description="Invalid cursor")
+        after = (after_date, int(after_id))
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 5000)
+    rows, cursor = transaction_store.in_range(session['username'], start, end, account=account,
+                                              min_amount=_amount_arg('min_amount'),
+                                              max_amount=_amount_arg('max_amount'), after=after, limit=limit)
+    return jsonify({'transactions': rows, 'next': f"{cursor[0]},{cursor[1]}" if cursor else None})
+
+@app.route('/transactions/monthly')
+def transaction_monthly_totals():
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    account, start, end = _transaction_filters()
+    months = transaction_store.monthly_totals(session['username'], account, start, end)
+    for month in months:
+        month['debit_total'] = post_processing.format_minor_units(month['debit_minor'])
+        month['credit_total'] = post_processing.format_minor_units(month['credit_minor'])
+    return jsonify({'months': months})
+
+@app.route('/transactions/summary')
+def transaction_summary():
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    account, start, end = _transaction_filters()
+    summary = transaction_store.summary(session['username'], account, start, end)
+    for kind in ('debit', 'credit'):
+        summary[kind]['total'] = post_processing.format_minor_units(summary[kind]['total_minor'])
+    return jsonify(summary)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint: job counts and per-stage time, pages and tokens summed over all jobs."""
+    summary = job_store.metrics_summary()
+    families = [
+        ('bank_jobs', 'gauge', 'Jobs by status.',
+         [({'status': status}, n) for status, n in sorted(summary['jobs'].items())]),
+        ('bank_job_stage_seconds_total', 'counter', 'Seconds spent per pipeline stage.',
+         [({'stage': stage}, round(seconds, 4)) for stage, seconds in sorted(summary['seconds'].items())]),
+        ('bank_job_stage_calls_total', 'counter', 'Times each pipeline stage ran.',
+         [({'stage': stage}, n) for stage, n in sorted(summary['calls'].items())]),
+    ]
+    for name, value in sorted(summary['counters'].items()):
+        families.append((f'bank_job_{name}_total', 'counter', f'Total {name.replace("_", " ")} over all jobs.',
+                         [({}, value)]))
+    decode_seconds = summary['seconds'].get('llm.decode')
+    if decode_seconds:
+        families.append(('bank_job_decode_tokens_per_second', 'gauge', 'Generated tokens per second of decoding.',
+                         [({}, round(summary['counters'].get('tokens_out', 0) / decode_seconds, 2))]))
+    if summary['peak_rss_mb'] is not None:
+        families.append(('bank_job_peak_rss_megabytes', 'gauge', 'Largest RSS of a web worker sampled while it ran a job.',
+                         [({}, summary['peak_rss_mb'])]))
+    return Response(metrics.render_prometheus(families), mimetype='text/plain; version=0.0.4')
+
 @app.route('/download_file/<filename>')
 def download_file(filename):
-    return send_file(filename, as_attachment=True)
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    # Only the output CSV of one of the user's own jobs
+    if not job_store.owns_output(session['username'], filename):
+        abort(404)
+    # ?format=parquet|arrow|jsonl converts the validated CSV to a typed export on first download
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.EXPORT_FORMATS:
+        abort(400)
+    # Jobs write their CSV in the working directory
+    csv_file = os.path.abspath(filename)
+    if not os.path.isfile(csv_file):
+        abort(404)
+    return send_file(export.export_csv_file(csv_file, fmt), as_attachment=True)
 
 @app.route('/logout')
 def logout():
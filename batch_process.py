@@ -0,0 +1,234 @@
+"""
+Reprocesses a directory (or manifest) of statements from the command line.
+
+Usage:
+    python batch_process.py archive/ --output-dir reprocessed [--backend rules] [--ocr-workers 4]
+    python batch_process.py manifest.txt --output-dir reprocessed
+
+A manifest lists one PDF per line (relative paths are relative to the manifest; blank lines
+and lines starting with # are ignored). Each statement's validated CSV is written under
+--output-dir, mirroring its path below the input directory.
+
+OCR runs in a process pool, one statement per process, while this process extracts and
+validates the statements whose OCR has finished, so OCR of the next files overlaps extraction
+of the current one. Every finished file is appended to a checkpoint in the output directory;
+running the same command again after an interruption skips the files already done (a file
+that changed since, by size or modification time, is processed again).
+"""
+import argparse
+import collections
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cache
+import metrics
+import pipeline
+from ocr_2 import OCR_POOL_CONTEXT, _init_ocr_worker, ocr_pdf_to_text
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+
+def find_statements(source):
+    """
+    Lists the PDFs to process.
+
+    Args:
+        source (str): A directory (searched recursively) or a manifest file.
+
+    Returns:
+        tuple: (root directory output paths are made relative to, sorted list of PDF paths)
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(folder, name) for folder, _, names in os.walk(source)
+                 for name in names if name.lower().endswith('.pdf')]
+        return source, sorted(paths)
+
+    root = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                paths.append(line if os.path.isabs(line) else os.path.join(root, line))
+    return root, paths
+
+def output_path(file_path, root, output_dir):
+    """Validated CSV path for file_path, mirroring its location below root."""
+    relative = os.path.relpath(os.path.abspath(file_path), os.path.abspath(root))
+    if relative.startswith('..'):
+        relative = os.path.basename(file_path)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + '.csv')
+
+def _file_key(file_path):
+    # Size and modification time tell a changed file apart without hashing the whole archive up front
+    stat = os.stat(file_path)
+    return f"{os.path.abspath(file_path)}|{stat.st_size}|{int(stat.st_mtime)}"
+
+def load_checkpoint(output_dir):
+    """Returns the keys of the files a previous run finished."""
+    done = set()
+    try:
+        with open(os.path.join(output_dir, CHECKPOINT_FILE), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # last line cut short by the interruption
+                    continue
+                if entry.get('status') == 'done':
+                    done.add(entry['key'])
+    except OSError:
+        pass
+    return done
+
+def _append_checkpoint(checkpoint, entry):
+    checkpoint.write(json.dumps(entry) + "\n")
+    checkpoint.flush()
+    os.fsync(checkpoint.fileno())
+
+def _ocr_file(args):
+    """OCR process: returns the statement's text and the metrics of reading it."""
+    file_path, use_cache = args
+    with metrics.recording() as file_metrics:
+        text = None
+        if use_cache:
+            with metrics.timed('cache'):
+                content_hash = cache.hash_file(file_path)
+                text = cache.get(content_hash, 'ocr', pipeline.ocr_version())
+        if text is None:
+            # One process per statement already keeps the CPUs busy, so each one OCRs its pages serially
+            with metrics.timed('ocr'):
+                text = ocr_pdf_to_text(file_path, workers=1)
+            if use_cache:
+                with metrics.timed('cache'):
+                    cache.put(content_hash, 'ocr', pipeline.ocr_version(), text)
+        else:
+            metrics.count('cache_hits')
+    return text, file_metrics.as_dict()
+
+def run_batch(paths, root, output_dir, backend=None, bank=None, ocr_workers=None, use_cache=True):
+    """
+    Runs the pipeline over every statement not already in the checkpoint.
+
+    Args:
+        paths (list): PDF paths, processed in this order.
+        root (str): Directory the output paths mirror (see output_path).
+        output_dir (str): Where the CSVs and the checkpoint are written.
+        backend (str): Extraction backend name (see extraction.get_backend).
+        bank (str): Bank template used to pick the backend when none is given.
+        ocr_workers (int): OCR processes (default is the number of CPUs).
+        use_cache (bool): Read and write the pipeline's result cache (default is True).
+
+    Returns:
+        dict: Aggregate counts, stage seconds and throughput of this run
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    done = load_checkpoint(output_dir)
+    todo, missing = [], []
+    for path in paths:
+        try:
+            todo.append((path, _file_key(path)))
+        except OSError as e:  # e.g. a manifest entry that doesn't exist; recorded as failed below
+            missing.append((path, e))
+    skipped = sum(1 for _, key in todo if key in done)
+    todo = [(path, key) for path, key in todo if key not in done]
+    print(f"{len(paths)} statements, {skipped} already done, {len(todo)} to process"
+          + (f", {len(missing)} unreadable" if missing else ""))
+
+    ocr_workers = max(1, min(ocr_workers or os.cpu_count() or 1, len(todo) or 1))
+    totals = collections.Counter()
+    run_metrics = metrics.RequestMetrics()
+    start = time.perf_counter()
+
+    pool = ProcessPoolExecutor(max_workers=ocr_workers, initializer=_init_ocr_worker,
+                               mp_context=OCR_POOL_CONTEXT)
+    pending = collections.deque()
+    queue = iter(todo)
+    try:
+        with open(os.path.join(output_dir, CHECKPOINT_FILE), 'a', encoding='utf-8') as checkpoint:
+            for file_path, error in missing:
+                print(f"Failed: {file_path}: {error}")
+                totals['failed'] += 1
+                _append_checkpoint(checkpoint, {'key': os.path.abspath(file_path), 'path': file_path,
+                                                'output': output_path(file_path, root, output_dir),
+                                                'status': 'failed', 'error': str(error)})
+            while True:
+                # Keep the OCR pool one round ahead of extraction, without holding the whole archive's text
+                while len(pending) < 2 * ocr_workers:
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    pending.append((item, pool.submit(_ocr_file, (item[0], use_cache))))
+                if not pending:
+                    break
+
+                (file_path, key), future = pending.popleft()
+                csv_file = output_path(file_path, root, output_dir)
+                entry = {'key': key, 'path': file_path, 'output': csv_file}
+                file_start = time.perf_counter()
+                try:
+                    with metrics.recording() as file_metrics:
+                        text, ocr_metrics = future.result()
+                        metrics.merge(ocr_metrics)
+                        os.makedirs(os.path.dirname(csv_file) or '.', exist_ok=True)
+                        rows = 0
+                        for rows, _ in enumerate(pipeline.stream_pipeline(
+                                file_path, csv_file, use_cache=use_cache, backend=backend, bank=bank,
+                                text=text), 1):
+                            pass
+                except Exception as e:
+                    print(f"Failed: {file_path}: {e}")
+                    totals['failed'] += 1
+                    _append_checkpoint(checkpoint, dict(entry, status='failed', error=str(e)))
+                    continue
+
+                pages = text.count("\n=== Page ")
+                totals['done'] += 1
+                totals['pages'] += pages
+                totals['rows'] += rows
+                run_metrics.merge(file_metrics.as_dict())
+                _append_checkpoint(checkpoint, dict(entry, status='done', pages=pages, rows=rows,
+                                                    seconds=round(time.perf_counter() - file_start, 3),
+                                                    metrics=file_metrics.as_dict()))
+                print(f"[{totals['done'] + totals['failed']}/{len(todo) + len(missing)}] {file_path}: {pages} pages, {rows} rows")
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume.")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    wall_seconds = time.perf_counter() - start
+    return {
+        'files': len(paths),
+        'skipped': skipped,
+        'done': totals['done'],
+        'failed': totals['failed'],
+        'pages': totals['pages'],
+        'rows': totals['rows'],
+        'wall_seconds': round(wall_seconds, 2),
+        'files_per_minute': round(totals['done'] * 60 / wall_seconds, 2) if wall_seconds else None,
+        'pages_per_second': round(totals['pages'] / wall_seconds, 3) if wall_seconds else None,
+        # OCR seconds are summed over the pool's processes, so they can exceed the wall time
+        'stage_seconds': {stage: round(seconds, 2) for stage, seconds in run_metrics.seconds.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Run OCR, extraction and validation over many statements.")
+    parser.add_argument('source', help="Directory of PDFs, or a manifest with one PDF path per line")
+    parser.add_argument('--output-dir', default='batch_output', help="Where the CSVs and the checkpoint go")
+    parser.add_argument('--backend', help="Extraction backend (default: picked by --bank, else llm)")
+    parser.add_argument('--bank', help="Bank template used to pick the backend")
+    parser.add_argument('--ocr-workers', type=int, help="OCR processes (default: one per CPU)")
+    parser.add_argument('--no-cache', action='store_true', help="Don't read or write the result cache")
+    args = parser.parse_args()
+
+    root, paths = find_statements(args.source)
+    summary = run_batch(paths, root, args.output_dir, backend=args.backend, bank=args.bank,
+                        ocr_workers=args.ocr_workers, use_cache=not args.no_cache)
+
+    print(f"\nProcessed {summary['done']} statements ({summary['failed']} failed, {summary['skipped']} skipped "
+          f"from earlier runs): {summary['pages']} pages, {summary['rows']} rows in {summary['wall_seconds']}s")
+    print(f"Throughput: {summary['files_per_minute']} files/min, {summary['pages_per_second']} pages/s")
+    print("Stage seconds: " + ", ".join(f"{stage} {seconds}" for stage, seconds in summary['stage_seconds'].items()))
+
+if __name__ == '__main__':
+    main()
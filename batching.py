@@ -0,0 +1,125 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+class BatchScheduler:
+    """
+    Gathers concurrently submitted prompts and runs them through the model as one batch.
+
+    A background thread waits for the first pending prompt, keeps collecting for up to
+    window_ms (or until max_batch prompts or max_tokens padded tokens are queued), then
+    calls run_batch once with all of them and hands each caller its own result. A caller
+    that wants its output while the batch is still running passes a listener, which
+    run_batch feeds with that prompt's new tokens as they are generated.
+    """
+
+    def __init__(self, run_batch, count_tokens=len, window_ms=50, max_batch=4, max_tokens=16384):
+        """
+        Args:
+            run_batch (callable): Takes a list of prompts and a list of their listeners (None where
+                there is none) and returns a list of results in the same order.
+            count_tokens (callable): Token count of one prompt, used for the padded-token budget.
+            window_ms (float): How long to wait for more prompts after the first one arrives.
+            max_batch (int): Most prompts per batch.
+            max_tokens (int): Most padded tokens per batch (longest prompt x batch size).
+        """
+        self.run_batch = run_batch
+        self.count_tokens = count_tokens
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.max_tokens = max_tokens
+
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = collections.Counter()
+        self._queue_waits = collections.deque(maxlen=1000)
+        self._requests = 0
+        self._batches = 0
+
+        self._thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt, listener=None):
+        """
+        Queues a prompt and returns a Future for its result.
+
+        Args:
+            prompt (str): The prompt.
+            listener (callable): If given, called from the scheduler's thread with each list of
+                token ids generated for this prompt, while its batch runs.
+        """
+        future = Future()
+        item = (prompt, self.count_tokens(prompt), time.monotonic(), future, listener)
+        with self._condition:
+            self._pending.append(item)
+            self._condition.notify()
+        return future
+
+    def _take_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = self._pending[0][2] + self.window
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = [self._pending.popleft()]
+            longest = batch[0][1]
+            while self._pending and len(batch) < self.max_batch:
+                tokens = self._pending[0][1]
+                if max(longest, tokens) * (len(batch) + 1) > self.max_tokens:
+                    break
+                longest = max(longest, tokens)
+                batch.append(self._pending.popleft())
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._take_batch()
+            started = time.monotonic()
+            with self._stats_lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._queue_waits.extend(started - submitted for _, _, submitted, _, _ in batch)
+
+            try:
+                results = self.run_batch([prompt for prompt, _, _, _, _ in batch],
+                                         [listener for _, _, _, _, listener in batch])
+            except Exception as e:
+                for _, _, _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, _, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def metrics(self):
+        """Batch size distribution and queue wait (seconds) over the most recent requests."""
+        with self._stats_lock:
+            waits = sorted(self._queue_waits)
+            sizes = dict(sorted(self._batch_sizes.items()))
+            requests, batches = self._requests, self._batches
+        with self._condition:
+            queued = len(self._pending)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4) if waits else None
+
+        return {
+            'requests': requests,
+            'batches': batches,
+            'mean_batch_size': round(requests / batches, 2) if batches else None,
+            'batch_sizes': sizes,
+            'queued': queued,
+            'queue_wait_p50': percentile(0.50),
+            'queue_wait_p95': percentile(0.95),
+            'queue_wait_max': round(waits[-1], 4) if waits else None,
+            'window_ms': self.window * 1000,
+            'max_batch': self.max_batch,
+            'max_tokens': self.max_tokens,
+        }
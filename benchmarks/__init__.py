@@ -0,0 +1 @@
+"""Performance benchmarks; run each one from the repository root with python -m benchmarks.<name>."""
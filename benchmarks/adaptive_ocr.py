@@ -0,0 +1,121 @@
+"""
+Reports the OCR time adaptive mode saves against the confidence and validation results it keeps.
+
+Usage:
+    python -m benchmarks.adaptive_ocr ["Brac 1.pdf" ...] [--dpis 150 200] [--thresholds 70 80 90]
+                                      [--retry-dpi 300] [--backend rules] [--output adaptive_ocr.json]
+
+Every document is OCR'd once in the fixed mode (ocr_2.OCR_DPI, full colour) and once per
+adaptive setting (start DPI x confidence threshold), then extracted and validated the same way
+each time. Without PDFs, synthetic statements are rendered with benchmarks.synthetic, which
+also gives the recall against their known transactions. Needs Poppler and Tesseract.
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import extraction
+import ocr_2
+from benchmarks import statements as statement_benchmark
+from benchmarks import synthetic
+
+def measure(documents, backend, options, workers, poppler_path, tmp):
+    """OCRs, extracts and validates every document with one set of OCR options and returns the totals."""
+    totals = {'ocr_seconds': 0.0, 'pages': 0, 'pages_retried': 0, 'rows': 0, 'status_ok': 0,
+              'matched': 0, 'truth': 0}
+    confidences = []
+    for i, (pdf_path, statement) in enumerate(documents):
+        if statement and backend.name == 'oracle':
+            backend.lines = statement['transaction_lines']
+        page_sources = []
+        rows, statement_metrics = statement_benchmark.run_statement(
+            statement or {}, backend, os.path.join(tmp, f"document_{i}.csv"), pdf_path, workers, poppler_path,
+            ocr_options=dict(options, page_sources=page_sources, use_text_layer=False))
+        totals['ocr_seconds'] += statement_metrics['seconds'].get('ocr', 0.0)
+        totals['pages'] += len(page_sources)
+        totals['pages_retried'] += sum(1 for page in page_sources if page.get('retried'))
+        confidences.extend(page['confidence'] for page in page_sources if page.get('confidence') is not None)
+        totals['rows'] += len(rows)
+        totals['status_ok'] += sum(1 for row in rows if row['Status'] == "✅ OK")
+        if statement:
+            score = statement_benchmark.score(rows, statement['truth'])
+            totals['matched'] += score['matched']
+            totals['truth'] += score['truth']
+
+    return {
+        'options': options,
+        'ocr_seconds': round(totals['ocr_seconds'], 3),
+        'pages': totals['pages'],
+        'pages_retried': totals['pages_retried'],
+        'mean_confidence': round(sum(confidences) / len(confidences), 1) if confidences else None,
+        'min_confidence': round(min(confidences), 1) if confidences else None,
+        'rows': totals['rows'],
+        'validation_pass_rate': round(totals['status_ok'] / totals['rows'], 4) if totals['rows'] else None,
+        'recall': round(totals['matched'] / totals['truth'], 4) if totals['truth'] else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fixed and adaptive OCR resolution on statements.")
+    parser.add_argument('inputs', nargs='*', help="PDF statements (default: synthetic statements)")
+    parser.add_argument('--statements', type=int, default=5, help="Synthetic statements when no PDFs are given")
+    parser.add_argument('--pages', type=int, default=2, help="Pages per synthetic statement")
+    parser.add_argument('--rows-per-page', type=int, default=25, help="Transactions per synthetic page")
+    parser.add_argument('--noise', type=float, default=0.2, help="OCR-style damage of the synthetic text")
+    parser.add_argument('--render-dpi', type=int, default=200, help="Resolution synthetic PDFs are drawn at")
+    parser.add_argument('--dpis', type=int, nargs='+', default=[150, 200], help="Adaptive start resolutions")
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[70, 80, 90],
+                        help="Mean word confidences below which a page is retried")
+    parser.add_argument('--retry-dpi', type=int, default=ocr_2.ADAPTIVE_RETRY_DPI, help="Retry resolution")
+    parser.add_argument('--backend', default='rules', choices=['oracle'] + list(extraction.BACKENDS),
+                        help="Extraction backend (oracle only works for synthetic statements)")
+    parser.add_argument('--workers', type=int, help="OCR processes (default: one per CPU)")
+    parser.add_argument('--poppler-path', help="Poppler binary directory (default: found on PATH)")
+    parser.add_argument('--output', default='adaptive_ocr.json', help="Where to write the results")
+    args = parser.parse_args()
+
+    if args.backend == 'oracle' and args.inputs:
+        parser.error("the oracle backend needs synthetic statements")
+    backend = statement_benchmark.OracleBackend() if args.backend == 'oracle' else extraction.get_backend(args.backend)
+
+    settings = [{'adaptive': False}]
+    settings += [{'adaptive': True, 'dpi': dpi, 'retry_dpi': args.retry_dpi, 'min_confidence': threshold}
+                 for dpi in args.dpis for threshold in args.thresholds]
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.inputs:
+            documents = [(path, None) for path in args.inputs]
+        else:
+            documents = []
+            for i in range(args.statements):
+                statement = synthetic.generate_statement(args.pages, args.rows_per_page, args.noise, i)
+                pdf_path = synthetic.render_pdf(statement['pages'], os.path.join(tmp, f"statement_{i}.pdf"),
+                                                dpi=args.render_dpi)
+                documents.append((pdf_path, statement))
+
+        for options in settings:
+            results.append(measure(documents, backend, options, args.workers, args.poppler_path, tmp))
+            print(f"Measured {options}")
+
+    baseline = results[0]['ocr_seconds']
+    for result in results:
+        result['time_saved'] = round(1 - result['ocr_seconds'] / baseline, 4) if baseline else None
+
+    print(f"\n{'mode':<24} {'OCR s':>8} {'saved':>7} {'retried':>9} {'mean conf':>9} {'min conf':>8} "
+          f"{'pass rate':>9} {'recall':>7}")
+    for result in results:
+        options = result['options']
+        mode = (f"adaptive {options['dpi']} DPI <{options['min_confidence']:g}" if options['adaptive']
+                else f"fixed {ocr_2.OCR_DPI} DPI")
+        saved = f"{result['time_saved']:+.1%}" if result['time_saved'] is not None else "-"
+        print(f"{mode:<24} {result['ocr_seconds']:>8} {saved:>7} "
+              f"{result['pages_retried']:>4}/{result['pages']:<4} {str(result['mean_confidence']):>9} "
+              f"{str(result['min_confidence']):>8} {str(result['validation_pass_rate']):>9} {str(result['recall']):>7}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'config': vars(args), 'results': results}, f, indent=2)
+    print(f"Results saved to {os.path.abspath(args.output)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Measures decode tokens/sec of speculative decoding (model.DECODING_MODES) against plain greedy decoding.
+
+Usage:
+    python -m benchmarks.decoding "Brac 1.pdf" statement2.txt [--modes off prompt_lookup assisted]
+                                  [--precision int8] [--lookup-tokens 10] [--max-ngram 3]
+
+PDFs are OCR'd first; .txt files are read as OCR text. Without inputs a synthetic statement
+(benchmarks.synthetic) is used. Every chunk is generated once per mode; the answers of each
+mode are compared with plain decoding, which they should match exactly. "assisted" needs
+MODEL_DRAFT_PATH.
+"""
+import argparse
+
+import model
+from benchmarks import synthetic
+from benchmarks.inputs import load_texts
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark speculative decoding against plain greedy decoding.")
+    parser.add_argument('inputs', nargs='*', help="Statement PDFs or OCR text files")
+    parser.add_argument('--modes', nargs='+', choices=model.DECODING_MODES, default=["off", "prompt_lookup"],
+                        help="Decoding modes to compare; plain decoding is always run as the reference")
+    parser.add_argument('--precision', choices=model.PRECISIONS, help="Overrides MODEL_PRECISION")
+    parser.add_argument('--lookup-tokens', type=int, default=model.PROMPT_LOOKUP_TOKENS,
+                        help="Tokens drafted per prompt-lookup step")
+    parser.add_argument('--max-ngram', type=int, default=model.PROMPT_LOOKUP_MAX_NGRAM,
+                        help="Longest n-gram matched against the prompt")
+    args = parser.parse_args()
+
+    texts = load_texts(args.inputs)
+    if not texts:
+        texts.append(("synthetic", synthetic.generate_statement(pages=1, rows_per_page=20)['text']))
+
+    model.PROMPT_LOOKUP_TOKENS = args.lookup_tokens
+    model.PROMPT_LOOKUP_MAX_NGRAM = args.max_ngram
+    model.load_model(args.precision)
+    chunks = [chunk for _, text in texts for chunk in model.split_into_chunks(text)]
+
+    modes = ["off"] + [mode for mode in args.modes if mode != "off"]
+    results = {}
+    for mode in modes:
+        model.decoding_mode = mode
+        print(f"Generating {len(chunks)} chunk(s) with decoding '{mode}'...")
+        results[mode] = [model._run_batch([chunk])[0] for chunk in chunks]
+
+    reference = results["off"]
+    off_rate = None
+    print(f"\n{'mode':<14} {'tokens':>7} {'decode s':>9} {'tok/s':>8} {'steps':>7} {'tok/step':>9} "
+          f"{'speedup':>8} {'identical':>10}")
+    for mode, outputs in results.items():
+        tokens = sum(stats['tokens_out'] for _, stats in outputs)
+        seconds = sum(stats['decode_seconds'] for _, stats in outputs)
+        steps = sum(stats['decode_steps'] for _, stats in outputs)
+        rate = tokens / seconds if seconds else 0.0
+        off_rate = off_rate or rate
+        identical = sum(answer == ref_answer for (answer, _), (ref_answer, _) in zip(outputs, reference))
+        print(f"{mode:<14} {tokens:>7} {seconds:>9.2f} {rate:>8.2f} {steps:>7} "
+              f"{tokens / steps if steps else 0:>9.2f} {rate / off_rate if off_rate else 0:>7.2f}x "
+              f"{identical:>5}/{len(chunks):<4}")
+    print(f"\nModel precision: {model.loaded_precision}, prompt lookup: {args.lookup_tokens} tokens, "
+          f"n-grams up to {args.max_ngram}")
+
+if __name__ == '__main__':
+    main()
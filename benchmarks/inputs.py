@@ -0,0 +1,22 @@
+"""Statement inputs shared by the benchmarks and precision_check.py."""
+
+def load_texts(paths):
+    """
+    Reads the OCR text of each input: .txt files are taken as OCR text, anything else is
+    OCR'd as a PDF (which needs Poppler and Tesseract).
+
+    Args:
+        paths (list): Statement PDFs or OCR text files.
+
+    Returns:
+        list: (path, text) pairs, in the order given
+    """
+    texts = []
+    for path in paths:
+        if path.lower().endswith('.txt'):
+            with open(path, 'r', encoding='utf-8') as f:
+                texts.append((path, f.read()))
+        else:
+            from ocr_2 import ocr_pdf_to_text
+            texts.append((path, ocr_pdf_to_text(path)))
+    return texts
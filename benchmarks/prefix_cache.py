@@ -0,0 +1,113 @@
+"""
+Measures the prefill time saved by reusing the cached prompt prefix (model.PROMPT_PREFIX).
+
+Usage:
+    python -m benchmarks.prefix_cache "Brac 1.pdf" statement2.txt [--precision int8] [--repeats 3]
+
+PDFs are OCR'd first; .txt files are read as OCR text. Without inputs a synthetic statement
+is used. For every chunk the prompt is prefilled twice, once from scratch and once on top of
+a copy of the prefix cache, and the faster of --repeats runs is kept for each.
+"""
+import argparse
+import copy
+import time
+
+import torch
+
+import model
+from benchmarks.inputs import load_texts
+
+SAMPLE_LINES = [
+    "09-Apr-2023 2004204258873001 Loan Disbursement Debit 2,000,000.00 -2,000,000.00",
+    "09-May-2023 Loan Recovery From -2004204258873007 82,104.00 -1,917,896.00",
+    "08-Jun-2023 Loan Recovery From -2004204258873001 82,104.00 -1,835,792.00",
+    "09-Aug-2023 6042588730002 Penal Int 58.35 -1,835,850.35",
+    "RAHMAN ELECTRIC AND HARDWARE Cust ID 04258873",
+]
+
+def synthetic_statement(pages=3, lines_per_page=30):
+    """OCR-like text with page markers, built from the prompt's example lines."""
+    text = []
+    for page in range(1, pages + 1):
+        text.append(f"=== Page {page} ===")
+        text.extend(SAMPLE_LINES[i % len(SAMPLE_LINES)] for i in range(lines_per_page))
+    return "\n".join(text)
+
+def _best_of(repeats, fn):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best, result
+
+def measure_chunk(chunk, repeats):
+    """Returns prefill timings (seconds) and token counts for one chunk's prompt."""
+    input_ids = model.tokenizer(model.build_prompt(chunk), return_tensors="pt")["input_ids"].to(model.model.device)
+    n = model.prefix_ids.shape[1]
+    if not torch.equal(input_ids[0, :n], model.prefix_ids[0]):
+        raise RuntimeError("Prompt tokens do not start with the cached prefix")
+
+    def full():
+        with torch.no_grad():
+            return model.model(input_ids, use_cache=True).logits[0, -1]
+
+    def cached():
+        with torch.no_grad():
+            past = copy.deepcopy(model.prefix_cache)
+            return model.model(input_ids[:, n:], past_key_values=past, use_cache=True).logits[0, -1]
+
+    full_seconds, full_logits = _best_of(repeats, full)
+    cached_seconds, cached_logits = _best_of(repeats, cached)
+    copy_seconds, _ = _best_of(repeats, lambda: copy.deepcopy(model.prefix_cache))
+    return {
+        'prompt_tokens': input_ids.shape[1],
+        'prefix_tokens': n,
+        'full_seconds': full_seconds,
+        'cached_seconds': cached_seconds,
+        'copy_seconds': copy_seconds,
+        'max_logit_diff': (full_logits.float() - cached_logits.float()).abs().max().item(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prefill time with and without the prompt prefix cache.")
+    parser.add_argument('inputs', nargs='*', help="Statement PDFs or OCR text files")
+    parser.add_argument('--precision', choices=model.PRECISIONS, help="Overrides MODEL_PRECISION")
+    parser.add_argument('--repeats', type=int, default=3, help="Runs per measurement; the fastest is kept")
+    args = parser.parse_args()
+
+    texts = load_texts(args.inputs)
+    if not texts:
+        texts.append(("synthetic", synthetic_statement()))
+
+    model.load_model(args.precision)
+    if model.prefix_cache is None:
+        model.build_prefix_cache()
+
+    print(f"\n{'input':<24} {'chunk':>5} {'tokens':>7} {'full ms':>9} {'cached ms':>10} {'copy ms':>8} "
+          f"{'saved ms':>9} {'logit diff':>11}")
+    all_chunks = []
+    for name, text in texts:
+        request = []
+        for i, chunk in enumerate(model.split_into_chunks(text), 1):
+            m = measure_chunk(chunk, args.repeats)
+            request.append(m)
+            print(f"{name[:24]:<24} {i:>5} {m['prompt_tokens']:>7} {m['full_seconds'] * 1000:>9.1f} "
+                  f"{m['cached_seconds'] * 1000:>10.1f} {m['copy_seconds'] * 1000:>8.1f} "
+                  f"{(m['full_seconds'] - m['cached_seconds']) * 1000:>9.1f} {m['max_logit_diff']:>11.2e}")
+        full = sum(m['full_seconds'] for m in request)
+        cached = sum(m['cached_seconds'] for m in request)
+        print(f"{name[:24]:<24} {'all':>5} {sum(m['prompt_tokens'] for m in request):>7} {full * 1000:>9.1f} "
+              f"{cached * 1000:>10.1f} {'':>8} {(full - cached) * 1000:>9.1f}")
+        all_chunks.extend(request)
+
+    saved = [m['full_seconds'] - m['cached_seconds'] for m in all_chunks]
+    prefix_tokens = all_chunks[0]['prefix_tokens']
+    print(f"\nPrefix: {prefix_tokens} tokens ({model.loaded_precision})")
+    print(f"Prefill saved per chunk:   {sum(saved) / len(saved) * 1000:.1f} ms on average")
+    print(f"Prefill saved per request: {sum(saved) / len(texts) * 1000:.1f} ms on average "
+          f"over {len(texts)} statement(s), {len(all_chunks) / len(texts):.1f} chunks each")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""
+End-to-end benchmark on synthetic statements with known ground truth.
+
+Usage:
+    python -m benchmarks.statements [--statements 20] [--pages 2] [--rows-per-page 25] [--noise 0.2]
+                                    [--backend oracle|rules|llm] [--ocr] [--output results.json]
+                                    [--compare baseline.json]
+
+Each statement goes through the stages of pipeline.stream_pipeline without the result cache:
+OCR, extraction with the chosen backend, and post-processing (cleaning, validation and CSV
+writing), each timed with metrics.py. Without --ocr the generated text stands in for the OCR
+output; with it, every statement is rendered to an image-only PDF and read back with
+ocr_pdf_to_text, which needs Poppler and Tesseract.
+
+The "oracle" backend returns the ground-truth transaction lines, so OCR and post-processing
+can be measured without a model; "rules" and "llm" are the real backends from extraction.py.
+Results are written as JSON; --compare prints the change against an earlier results file and
+exits with status 1 when latency or accuracy regressed by more than --tolerance.
+"""
+import argparse
+import collections
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import extraction
+import metrics
+import post_processing
+from benchmarks import synthetic
+
+STAGES = ('ocr', 'extraction', 'post_processing', 'total')
+
+class OracleBackend(extraction.ExtractionBackend):
+    """Returns the statement's known transaction lines, whatever the text says."""
+
+    name = "oracle"
+    version = "oracle-1"
+
+    def __init__(self):
+        self.lines = []
+
+    def extract(self, text, progress=None):
+        if progress:
+            progress(1, 1)
+        return "\n".join(self.lines)
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else None
+
+def _row_key(row):
+    try:
+        amount = post_processing.to_minor_units(row['Amount']) if row['Amount'] else None
+        balance = post_processing.to_minor_units(row['Balance']) if row['Balance'] else None
+    except ValueError:
+        return None
+    return row['Date'], amount, balance
+
+def score(rows, truth):
+    """
+    Compares validated rows with the ground truth on (date, amount, balance).
+
+    Returns:
+        dict: matched, rows and truth counts, correct debit/credit labels among the matched
+              rows, and OK statuses
+    """
+    truth_types = {}
+    remaining = collections.Counter()
+    for t in truth:
+        key = (t['date'], t['amount_minor'], t['balance_minor'])
+        remaining[key] += 1
+        truth_types[key] = t['type']
+
+    matched = types_correct = 0
+    for row in rows:
+        key = _row_key(row)
+        if remaining[key] > 0:
+            remaining[key] -= 1
+            matched += 1
+            types_correct += row['Label'].lower() == truth_types[key]
+    return {
+        'matched': matched,
+        'rows': len(rows),
+        'truth': len(truth),
+        'types_correct': types_correct,
+        'status_ok': sum(1 for row in rows if row['Status'] == "✅ OK"),
+    }
+
+def run_statement(statement, backend, csv_path, pdf_path=None, ocr_workers=None, poppler_path=None,
+                  ocr_options=None):
+    """
+    Runs one statement through every stage and returns (rows, metrics dict). ocr_options are
+    passed on to ocr_pdf_to_text (e.g. adaptive, dpi, min_confidence).
+    """
+    with metrics.recording() as request_metrics:
+        if pdf_path:
+            from ocr_2 import ocr_pdf_to_text
+            with metrics.timed('ocr'):
+                text = ocr_pdf_to_text(pdf_path, workers=ocr_workers, poppler_path=poppler_path,
+                                       **(ocr_options or {}))
+        else:
+            text = statement['text']
+        with metrics.timed('extraction'):
+            extracted = backend.extract(text)
+        with metrics.timed('post_processing'):
+            records = post_processing.validate_bank_lines(
+                post_processing.clean_bank_statement(post_processing.clean_bank_lines(extracted)))
+            rows = list(post_processing.stream_validated_csv(records, csv_path))
+    return rows, request_metrics.as_dict()
+
+def summarize(results, wall_seconds, config):
+    """Aggregates per-statement results into latency percentiles, throughput, memory and accuracy."""
+    stages = {}
+    for stage in STAGES:
+        values = [r['metrics']['seconds'].get(stage, 0.0) for r in results]
+        stages[stage] = {
+            'mean': round(sum(values) / len(values), 4),
+            'p50': round(_percentile(values, 0.50), 4),
+            'p95': round(_percentile(values, 0.95), 4),
+            'p99': round(_percentile(values, 0.99), 4),
+            'max': round(max(values), 4),
+        }
+
+    totals = collections.Counter()
+    for r in results:
+        totals.update(r['score'])
+    pages = config['pages'] * len(results)
+    return {
+        'config': config,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'stages': stages,
+        'throughput': {
+            'wall_seconds': round(wall_seconds, 3),
+            'statements_per_second': round(len(results) / wall_seconds, 3),
+            'pages_per_second': round(pages / wall_seconds, 3),
+            'rows_per_second': round(totals['rows'] / wall_seconds, 1),
+        },
+        'memory': {
+            'peak_rss_mb': metrics.peak_rss_mb(),
+            'children_peak_rss_mb': metrics.peak_rss_mb(children=True),
+        },
+        'accuracy': {
+            'precision': round(totals['matched'] / totals['rows'], 4) if totals['rows'] else None,
+            'recall': round(totals['matched'] / totals['truth'], 4) if totals['truth'] else None,
+            'type_accuracy': round(totals['types_correct'] / totals['matched'], 4) if totals['matched'] else None,
+            'validation_pass_rate': round(totals['status_ok'] / totals['rows'], 4) if totals['rows'] else None,
+            'exact_statements': sum(1 for r in results if r['score']['matched'] == r['score']['rows']
+                                    == r['score']['truth']),
+        },
+        'statements': results,
+    }
+
+def compare(current, baseline, tolerance):
+    """Prints the change against a baseline results file and returns True if anything regressed."""
+    regressed = False
+    print(f"\n{'metric':<28} {'baseline':>10} {'current':>10} {'change':>8}")
+
+    def line(name, old, new, higher_is_better):
+        nonlocal regressed
+        if old is None or new is None:
+            return
+        change = (new - old) / old if old else 0.0
+        worse = change < -tolerance if higher_is_better else change > tolerance
+        regressed = regressed or worse
+        print(f"{name:<28} {old:>10} {new:>10} {change:>+7.1%}{'  REGRESSED' if worse else ''}")
+
+    for stage in STAGES:
+        line(f"{stage} p50 s", baseline['stages'][stage]['p50'], current['stages'][stage]['p50'], False)
+        line(f"{stage} p95 s", baseline['stages'][stage]['p95'], current['stages'][stage]['p95'], False)
+    line("statements/s", baseline['throughput']['statements_per_second'],
+         current['throughput']['statements_per_second'], True)
+    for name in ('precision', 'recall', 'type_accuracy', 'validation_pass_rate'):
+        # Accuracy regressions are flagged at any drop, not only beyond the latency tolerance
+        old, new = baseline['accuracy'][name], current['accuracy'][name]
+        if old is not None and new is not None:
+            worse = new < old
+            regressed = regressed or worse
+            print(f"{name:<28} {old:>10} {new:>10} {new - old:>+8.4f}{'  REGRESSED' if worse else ''}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic statements with known ground truth.")
+    parser.add_argument('--statements', type=int, default=20, help="Number of statements")
+    parser.add_argument('--pages', type=int, default=2, help="Pages per statement")
+    parser.add_argument('--rows-per-page', type=int, default=25, help="Transactions per page")
+    parser.add_argument('--noise', type=float, default=0.2, help="OCR-style damage, 0 (clean) to 1")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the first statement")
+    parser.add_argument('--backend', default='oracle', choices=['oracle'] + list(extraction.BACKENDS),
+                        help="Extraction backend")
+    parser.add_argument('--ocr', action='store_true', help="Render PDFs and OCR them instead of using the text")
+    parser.add_argument('--render-dpi', type=int, default=200, help="Resolution of the rendered PDFs")
+    parser.add_argument('--ocr-workers', type=int, help="OCR processes (default: one per CPU)")
+    parser.add_argument('--poppler-path', help="Poppler binary directory (default: found on PATH)")
+    parser.add_argument('--output', default='benchmark_results.json', help="Where to write the results")
+    parser.add_argument('--compare', metavar='BASELINE', help="Earlier results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed latency/throughput change")
+    args = parser.parse_args()
+
+    backend = OracleBackend() if args.backend == 'oracle' else extraction.get_backend(args.backend)
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+    config['backend_version'] = backend.version
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        statements = []
+        for i in range(args.statements):
+            statement = synthetic.generate_statement(args.pages, args.rows_per_page, args.noise, args.seed + i)
+            pdf_path = None
+            if args.ocr:
+                # Rendered up front so drawing the pages isn't counted as pipeline time
+                pdf_path = synthetic.render_pdf(statement['pages'], os.path.join(tmp, f"statement_{i}.pdf"),
+                                                dpi=args.render_dpi)
+            statements.append((statement, pdf_path))
+
+        start = time.perf_counter()
+        for i, (statement, pdf_path) in enumerate(statements):
+            if args.backend == 'oracle':
+                backend.lines = statement['transaction_lines']
+            rows, statement_metrics = run_statement(statement, backend, os.path.join(tmp, f"statement_{i}.csv"),
+                                                    pdf_path, args.ocr_workers, args.poppler_path)
+            results.append({'seed': args.seed + i, 'metrics': statement_metrics,
+                            'score': score(rows, statement['truth'])})
+            print(f"Statement {i + 1}/{args.statements}: {statement_metrics['seconds']['total']:.3f}s, "
+                  f"{results[-1]['score']['matched']}/{results[-1]['score']['truth']} transactions recovered")
+        wall_seconds = time.perf_counter() - start
+
+    summary = summarize(results, wall_seconds, config)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"\n{'stage':<16} {'mean s':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8}")
+    for stage, stats in summary['stages'].items():
+        print(f"{stage:<16} {stats['mean']:>8} {stats['p50']:>8} {stats['p95']:>8} {stats['p99']:>8}")
+    throughput, accuracy = summary['throughput'], summary['accuracy']
+    print(f"\nThroughput: {throughput['statements_per_second']} statements/s, "
+          f"{throughput['pages_per_second']} pages/s, {throughput['rows_per_second']} rows/s")
+    print(f"Peak RSS: {summary['memory']['peak_rss_mb']} MB (OCR workers: {summary['memory']['children_peak_rss_mb']} MB)")
+    print(f"Accuracy: precision {accuracy['precision']}, recall {accuracy['recall']}, "
+          f"type {accuracy['type_accuracy']}, validation pass rate {accuracy['validation_pass_rate']}, "
+          f"{accuracy['exact_statements']}/{len(results)} statements exact")
+    print(f"Results saved to {os.path.abspath(args.output)}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(summary, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
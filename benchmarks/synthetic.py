@@ -0,0 +1,141 @@
+"""
+Synthetic loan statements with known ground truth, for the benchmarks.
+
+Statements follow the layout build_prompt describes: one transaction per line, starting with
+a DD-MMM-YYYY date, then a description, the amount and the running balance. The noise level
+(0..1) controls how much OCR-style damage the text gets: stray symbols before the date,
+"2,000 00" for "2,000.00", spaces inside balances and garbage lines between rows. Only damage
+post_processing is meant to repair is introduced, so every transaction stays recoverable.
+"""
+import datetime
+import os
+import random
+
+from PIL import Image, ImageDraw, ImageFont
+
+LEADING_SYMBOLS = ["=", ";", ":", "=!", "|"]
+RECOVERY_ACCOUNT = "-2004204258873007"
+GARBAGE = ["~ ' ,. _", "| | |", "__ .", ":: -- ;", "' ` ,"]
+
+# Letter size page and text layout at the render DPI
+PAGE_INCHES = (8.5, 11)
+FONT_POINTS = 9
+FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    r"C:\Windows\Fonts\consola.ttf",
+    r"C:\Windows\Fonts\arial.ttf",
+]
+
+def _money(value):
+    return f"{value:,.2f}"
+
+def _damage_amount(text, rng, noise):
+    # OCR often reads the decimal point as a space; clean_bank_statement turns " 00" back into ".00"
+    if text.endswith(".00") and rng.random() < noise / 2:
+        return text[:-3] + " 00"
+    return text
+
+def _damage_balance(text, rng, noise):
+    # A comma read as a space inside the balance; the balance pattern allows internal spaces.
+    # Skipped before "00", which clean_bank_statement would take for a misread decimal point.
+    comma = text.find(",")
+    if comma >= 0 and not text.startswith("00", comma + 1) and rng.random() < noise / 2:
+        return text[:comma] + " " + text[comma + 1:]
+    return text
+
+def generate_statement(pages=2, rows_per_page=25, noise=0.2, seed=0):
+    """
+    Builds one loan statement.
+
+    Args:
+        pages (int): Number of pages.
+        rows_per_page (int): Transactions per page.
+        noise (float): 0 for clean text, up to 1 for heavily damaged text.
+        seed (int): Random seed; the same arguments always give the same statement.
+
+    Returns:
+        dict: 'pages' (list of page texts), 'text' (pages joined as ocr_pdf_to_text returns
+              them), 'transaction_lines' (the exact transaction lines, in order) and 'truth'
+              (one dict per transaction: date, amount_minor, balance_minor, type)
+    """
+    rng = random.Random(seed)
+    date = datetime.date(2023, 1, 1) + datetime.timedelta(days=rng.randrange(365))
+    customer = rng.randrange(10 ** 7, 10 ** 8)
+    principal = rng.randrange(5, 50) * 100000 * 100  # minor units
+    # Recoveries never add up to the principal, so the balance stays negative like a real loan account
+    max_recovery = max(200, principal // (pages * rows_per_page) // 100)
+    balance = 0
+
+    page_texts = []
+    transaction_lines = []
+    truth = []
+    for page in range(1, pages + 1):
+        lines = [
+            "BRAC BANK LIMITED",
+            f"RAHMAN ELECTRIC AND HARDWARE Cust ID {customer:08d}",
+            f"Statement of Account Page {page} of {pages}",
+            "Date Particulars Debit Credit Balance",
+        ]
+        for _ in range(rows_per_page):
+            if not truth:
+                amount, kind, description = principal, "debit", f"{customer}3001 Loan Disbursement Debit"
+            elif rng.random() < 0.15:
+                amount, kind, description = rng.randrange(1000, 20000), "debit", f"{customer}0002 Penal Int"
+            else:
+                amount, kind, description = rng.randrange(max_recovery // 10, max_recovery) * 100, "credit", \
+                    f"Loan Recovery From {RECOVERY_ACCOUNT}"
+            # Loan account: debits push the balance further below zero, recoveries bring it back up
+            balance = balance - amount if kind == "debit" else balance + amount
+            date += datetime.timedelta(days=rng.randrange(0, 20))
+
+            line = (f"{date.strftime('%d-%b-%Y')} {description} "
+                    f"{_damage_amount(_money(amount / 100), rng, noise)} "
+                    f"{_damage_balance(_money(balance / 100), rng, noise)}")
+            if rng.random() < noise:
+                line = f"{rng.choice(LEADING_SYMBOLS)} {line}"
+            lines.append(line)
+            transaction_lines.append(line)
+            truth.append({
+                'date': date.strftime('%d-%b-%Y'),
+                'amount_minor': amount,
+                'balance_minor': balance,
+                'type': kind,
+            })
+            if rng.random() < noise / 3:
+                lines.append(rng.choice(GARBAGE))
+        lines.append("This is a computer generated statement and does not require a signature.")
+        page_texts.append("\n".join(lines))
+
+    text = "".join(f"\n=== Page {i} ===\n{page_text}\n" for i, page_text in enumerate(page_texts, 1))
+    return {'pages': page_texts, 'text': text, 'transaction_lines': transaction_lines, 'truth': truth}
+
+def _font(size):
+    for path in FONT_PATHS:
+        if os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size=size)
+
+def render_pdf(page_texts, pdf_path, dpi=200):
+    """
+    Draws each page's text on a white page image and saves them as one image-only PDF,
+    like a scanned statement (no text layer, so every page has to go through OCR).
+    """
+    width, height = int(PAGE_INCHES[0] * dpi), int(PAGE_INCHES[1] * dpi)
+    margin = dpi // 2
+    # Shrink the text when a page has more lines than fit at the default size
+    most_lines = max(len(page_text.splitlines()) for page_text in page_texts)
+    line_height = min(int(FONT_POINTS * 1.6 * dpi / 72), (height - 2 * margin) // max(1, most_lines))
+    font = _font(int(line_height / 1.6))
+
+    images = []
+    for page_text in page_texts:
+        image = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        y = margin
+        for line in page_text.splitlines():
+            draw.text((margin, y), line, fill=0, font=font)
+            y += line_height
+        images.append(image)
+    images[0].save(pdf_path, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+    return pdf_path
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+
+# Directory holding cached pipeline results, one sub-folder per uploaded file content
+CACHE_DIR = "cache"
+
+# Total size the cache may grow to before the least recently used entries are evicted
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+def hash_file(file_path: str) -> str:
+    """Returns the SHA-256 hex digest of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _entry_path(content_hash: str, stage: str, version: str) -> str:
+    # The stage version is part of the file name, so bumping it turns old entries into misses
+    version_hash = hashlib.sha256(version.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, content_hash[:2], content_hash, f"{stage}-{version_hash}.json")
+
+def get(content_hash: str, stage: str, version: str):
+    """
+    Looks up a cached stage result.
+
+    Args:
+        content_hash (str): Hash of the uploaded file (see hash_file).
+        stage (str): Pipeline stage name, e.g. 'ocr', 'extraction' or 'rows'.
+        version (str): Version of the code/model that produced the stage result.
+
+    Returns:
+        The cached value, or None on a miss.
+    """
+    path = _entry_path(content_hash, stage, version)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Touch the entry so eviction sees it as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return value
+
+def put(content_hash: str, stage: str, version: str, value):
+    """Stores a JSON-serializable stage result and evicts old entries if the cache is over budget."""
+    path = _entry_path(content_hash, stage, version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(value, f)
+    # Atomic rename so concurrent workers never read a half-written entry
+    os.replace(tmp_path, path)
+    evict()
+
+def invalidate(content_hash: str | None = None, stage: str | None = None):
+    """
+    Removes cached entries.
+
+    Args:
+        content_hash (str): Only remove entries for this file (default: every file).
+        stage (str): Only remove entries for this stage (default: every stage).
+    """
+    if content_hash is None:
+        hashes = [h for prefix in _listdir(CACHE_DIR) for h in _listdir(os.path.join(CACHE_DIR, prefix))]
+    else:
+        hashes = [content_hash]
+
+    for h in hashes:
+        entry_dir = os.path.join(CACHE_DIR, h[:2], h)
+        if stage is None:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            continue
+        for name in _listdir(entry_dir):
+            if name.startswith(f"{stage}-"):
+                _remove(os.path.join(entry_dir, name))
+
+def evict(max_bytes: int | None = None):
+    """Deletes least recently used entries until the cache fits in max_bytes (default CACHE_MAX_BYTES)."""
+    if max_bytes is None:
+        max_bytes = CACHE_MAX_BYTES
+
+    entries = []
+    total = 0
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    if total <= max_bytes:
+        return
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+
+def _listdir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or clear the pipeline result cache.")
+    parser.add_argument('--invalidate', metavar='FILE_OR_HASH', nargs='?', const='*',
+                        help="Drop cached results for a file or content hash (all files if omitted)")
+    parser.add_argument('--stage', help="Restrict --invalidate to one stage (ocr, extraction, rows)")
+    args = parser.parse_args()
+
+    if args.invalidate:
+        target = args.invalidate
+        if target == '*':
+            target = None
+        elif os.path.isfile(target):
+            target = hash_file(target)
+        invalidate(target, args.stage)
+        print("Cache entries removed.")
+    else:
+        size = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, files in os.walk(CACHE_DIR) for name in files)
+        print(f"Cache size: {size / (1024 * 1024):.1f} MB of {CACHE_MAX_BYTES / (1024 * 1024):.0f} MB")
@@ -0,0 +1,146 @@
+"""
+Constrained generation for transaction extraction.
+
+TransactionLineProcessor only lets the model write lines of the form
+[leading symbols] DD-MMM-YYYY description amount balance, one per line, and ends the answer
+as soon as the model's own choice at the start of a line is anything else. RepeatedLineStoppingCriteria
+stops a sequence that starts writing lines it has already written. Every line of the answer
+is therefore a transaction line that post_processing can validate as it is.
+"""
+import regex
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+# A complete transaction line, as the prompt describes it. Numbers are as lenient as
+# post_processing's patterns: "2,000 00" (misread decimal point) and "-1,332 896.00"
+# (misread comma) are both repaired there. regex (not re) is used for its partial matching.
+TRANSACTION_LINE = regex.compile(
+    r'(?P<prefix>[=;:!|\s]*)'
+    r'(?P<date>\d{2}-(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)-\d{4})'
+    r' +(?P<description>\S.*?)'
+    r' +(?P<amount>-?[\d,]*\d(?:\.\d{2}| 00))'
+    r' +(?P<balance>-?[\d,]*\d(?:[ ,]\d{3})*(?:\.\d{2})?) *',
+    regex.IGNORECASE
+)
+
+# Highest-scoring tokens tried per step before giving up on the current line
+MAX_CANDIDATES = 50
+# Blank lines the model may write before its first transaction line
+MAX_LEADING_NEWLINES = 2
+
+_newline_ids = {}
+
+def newline_token_ids(tokenizer):
+    """Ids of every token whose text contains a line break (computed once per tokenizer)."""
+    key = id(tokenizer)
+    if key not in _newline_ids:
+        _newline_ids[key] = frozenset(
+            i for i in range(len(tokenizer)) if "\n" in tokenizer.decode([i], skip_special_tokens=True))
+    return _newline_ids[key]
+
+def _line_start(generated, newline_ids):
+    # Index of the last token that contains a line break, or 0 if there is none yet
+    for i in range(len(generated) - 1, -1, -1):
+        if generated[i] in newline_ids:
+            return i
+    return 0
+
+class TransactionLineProcessor(LogitsProcessor):
+    """
+    Masks every token that would break the transaction line form, so greedy decoding picks the
+    model's best token among those that keep the current line a prefix of TRANSACTION_LINE.
+
+    A line break or end of sequence is only allowed once the current line is complete. When the
+    model's own first choice at the start of a line doesn't fit (it wants to explain, or to
+    write a non-transaction line), the answer is over and end of sequence is forced.
+
+    Everything is derived from input_ids on each call, so the processor also works when assisted
+    decoding calls it on speculative continuations.
+    """
+
+    def __init__(self, tokenizer, prompt_length, eos_token_id, max_candidates=MAX_CANDIDATES):
+        """
+        Args:
+            tokenizer: The model's tokenizer.
+            prompt_length (int): Width of the (padded) prompt; tokens after it are the answer.
+            eos_token_id (int): End-of-sequence token.
+            max_candidates (int): Highest-scoring tokens tried per step.
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.eos_token_id = eos_token_id
+        self.max_candidates = max_candidates
+        self.newline_ids = newline_token_ids(tokenizer)
+
+    def __call__(self, input_ids, scores):
+        for row in range(input_ids.shape[0]):
+            generated = input_ids[row, self.prompt_length:].tolist()
+            if self.eos_token_id in generated:  # finished sequence in a batch, only padding follows
+                continue
+            allowed = self._next_token(generated, scores[row])
+            scores[row] = torch.full_like(scores[row], float('-inf'))
+            scores[row, allowed] = 0.0
+        return scores
+
+    def _next_token(self, generated, row_scores):
+        start = _line_start(generated, self.newline_ids)
+        line_ids = generated[start:]
+        base = self.tokenizer.decode(line_ids, skip_special_tokens=True)
+        current = base.rsplit("\n", 1)[-1]
+        before = self.tokenizer.decode(generated[:start], skip_special_tokens=True) + base[:len(base) - len(current)]
+        has_lines = bool(before.strip())
+
+        candidates = row_scores.topk(min(self.max_candidates, row_scores.shape[-1])).indices.tolist()
+        for rank, candidate in enumerate(candidates):
+            if candidate == self.eos_token_id:
+                if self._can_end(current):
+                    return candidate
+                continue
+            text = self.tokenizer.decode(line_ids + [candidate], skip_special_tokens=True)
+            if not text.startswith(base):
+                continue
+            if self._valid(current + text[len(base):], has_lines, before.count("\n")):
+                if rank > 0 and not current.strip():
+                    # The model's own choice for a new line wasn't a transaction line: it is done
+                    break
+                return candidate
+        # Nothing fits: end here (an unfinished line is left out of the records)
+        return self.eos_token_id
+
+    @staticmethod
+    def _can_end(current):
+        return not current.strip() or TRANSACTION_LINE.fullmatch(current) is not None
+
+    @staticmethod
+    def _valid(text, has_lines, newlines):
+        *complete, last = text.split("\n")
+        for line in complete:
+            if not line.strip():
+                # Blank lines only before the first transaction line, and only a couple
+                newlines += 1
+                if has_lines or newlines > MAX_LEADING_NEWLINES:
+                    return False
+            elif TRANSACTION_LINE.fullmatch(line) is None:
+                return False
+            else:
+                has_lines = True
+        return not last.strip() or TRANSACTION_LINE.fullmatch(last, partial=True) is not None
+
+class RepeatedLineStoppingCriteria(StoppingCriteria):
+    """Stops a sequence when it finishes a line it has already written, i.e. the model started looping."""
+
+    def __init__(self, tokenizer, prompt_length):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.newline_ids = newline_token_ids(tokenizer)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = []
+        for row in range(input_ids.shape[0]):
+            if input_ids[row, -1].item() not in self.newline_ids:
+                done.append(False)
+                continue
+            text = self.tokenizer.decode(input_ids[row, self.prompt_length:], skip_special_tokens=True)
+            lines = [" ".join(line.split()) for line in text.split("\n")[:-1] if line.strip()]
+            done.append(len(lines) != len(set(lines)))
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
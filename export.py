@@ -0,0 +1,204 @@
+"""
+Typed exports of validated statement rows: Parquet, Arrow IPC or JSON Lines next to the CSV.
+
+Dates are real dates, Amount/Balance integer minor units (paisa) and Type/Status enums, so
+analytics jobs don't have to re-parse the CSV's strings. Parquet and Arrow need pyarrow,
+which is optional; without it those formats are written as JSON Lines instead.
+"""
+import csv
+import datetime
+import json
+import os
+import re
+import tempfile
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+import post_processing
+
+EXPORT_FORMATS = ('csv', 'parquet', 'arrow', 'jsonl')
+FILE_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow', 'jsonl': '.jsonl'}
+
+# Enum values; their position is the dictionary code stored in Parquet/Arrow
+TYPES = ('debit', 'credit')
+STATUSES = ('ok', 'false', 'unknown')
+_TYPE_CODES = {'##': 0, '*': 1}
+_STATUS_CODES = {value: code for code, value in enumerate(STATUSES)}
+
+EXPECTED_PATTERN = re.compile(r'Expected: ([^)]+)\)')
+
+# Rows per Arrow record batch (and Parquet row group)
+BATCH_ROWS = 10000
+
+if pa is not None:
+    SCHEMA = pa.schema([
+        ('date', pa.date32()),
+        ('description', pa.string()),
+        ('type', pa.dictionary(pa.int8(), pa.string())),
+        ('amount_minor', pa.int64()),
+        ('balance_minor', pa.int64()),
+        ('status', pa.dictionary(pa.int8(), pa.string())),
+        ('expected_balance_minor', pa.int64()),
+    ])
+
+def resolve_format(fmt):
+    """Returns the format that will actually be written for fmt (JSON Lines when pyarrow is missing)."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt} (expected one of {', '.join(EXPORT_FORMATS)})")
+    if fmt in ('parquet', 'arrow') and pa is None:
+        print(f"pyarrow is not installed; writing JSON Lines instead of {fmt}.")
+        return 'jsonl'
+    return fmt
+
+def export_path(output_file, fmt):
+    """Path of the fmt export that sits next to output_file."""
+    return os.path.splitext(output_file)[0] + FILE_EXTENSIONS[fmt]
+
+def _minor_units(value):
+    # Empty, unparsable, or OCR-merged numbers too large for int64 are exported as nulls
+    try:
+        minor = post_processing.to_minor_units(value) if value else None
+    except ValueError:
+        return None
+    return minor if minor is not None and -2 ** 63 <= minor < 2 ** 63 else None
+
+def typed_record(record):
+    """
+    Converts one validated record (as written to the CSV) to typed values.
+
+    Args:
+        record (dict): Record keyed by post_processing.OUTPUT_HEADERS
+
+    Returns:
+        dict: date (datetime.date or None if OCR garbled it), description, type, amount_minor,
+              balance_minor, status and expected_balance_minor (only set for FALSE rows)
+    """
+    try:
+        date = datetime.datetime.strptime(record['Date'], "%d-%b-%Y").date()
+    except ValueError:
+        date = None
+
+    status_text = record['Status']
+    if status_text.startswith("✅"):
+        status = 'ok'
+    elif status_text.startswith("❌"):
+        status = 'false'
+    else:
+        status = 'unknown'
+    expected = EXPECTED_PATTERN.search(status_text)
+
+    return {
+        'date': date,
+        'description': record['Description'],
+        'type': TYPES[_TYPE_CODES[record['Type']]] if record['Type'] in _TYPE_CODES else None,
+        'amount_minor': _minor_units(record['Amount']),
+        'balance_minor': _minor_units(record['Balance']),
+        'status': status,
+        'expected_balance_minor': _minor_units(expected.group(1)) if expected else None,
+    }
+
+def _enum_array(values, codes, dictionary):
+    indices = pa.array([codes.get(value) for value in values], type=pa.int8())
+    return pa.DictionaryArray.from_arrays(indices, pa.array(dictionary, type=pa.string()))
+
+def _record_batch(rows):
+    # Every batch uses the full enum dictionaries, so all batches of a file share the same codes
+    return pa.record_batch([
+        pa.array([row['date'] for row in rows], type=pa.date32()),
+        pa.array([row['description'] for row in rows], type=pa.string()),
+        _enum_array([row['type'] for row in rows], {t: i for i, t in enumerate(TYPES)}, TYPES),
+        pa.array([row['amount_minor'] for row in rows], type=pa.int64()),
+        pa.array([row['balance_minor'] for row in rows], type=pa.int64()),
+        _enum_array([row['status'] for row in rows], _STATUS_CODES, STATUSES),
+        pa.array([row['expected_balance_minor'] for row in rows], type=pa.int64()),
+    ], schema=SCHEMA)
+
+def _stream_batches(records, write_batch):
+    pending = []
+    for record in records:
+        pending.append(typed_record(record))
+        yield record
+        if len(pending) >= BATCH_ROWS:
+            write_batch(_record_batch(pending))
+            pending = []
+    if pending:
+        write_batch(_record_batch(pending))
+
+def stream_parquet(records, output_file):
+    """Writes records to a Parquet file, BATCH_ROWS at a time, and passes each one on."""
+    with pq.ParquetWriter(output_file, SCHEMA) as writer:
+        yield from _stream_batches(records, writer.write_batch)
+
+def stream_arrow(records, output_file):
+    """Writes records to an Arrow IPC file, BATCH_ROWS at a time, and passes each one on."""
+    with pa.OSFile(output_file, 'wb') as sink, pa.ipc.new_file(sink, SCHEMA) as writer:
+        yield from _stream_batches(records, writer.write_batch)
+
+def stream_jsonl(records, output_file):
+    """Writes one typed JSON object per line and passes each record on."""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for record in records:
+            row = typed_record(record)
+            row['date'] = row['date'].isoformat() if row['date'] else None
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            yield record
+
+STREAM_WRITERS = {
+    'csv': post_processing.stream_validated_csv,
+    'parquet': stream_parquet,
+    'arrow': stream_arrow,
+    'jsonl': stream_jsonl,
+}
+
+def stream_export(records, output_file, fmt):
+    """
+    Writes records in the given format as they arrive and passes each one on, so several
+    writers can be chained over one stream of validated rows.
+
+    Args:
+        records (iterable): Validated records keyed by post_processing.OUTPUT_HEADERS
+        output_file (str): Path to write; use export_path(..., resolve_format(fmt)) for the extension
+        fmt (str): One of EXPORT_FORMATS
+
+    Yields:
+        dict: Each record, unchanged
+    """
+    return STREAM_WRITERS[resolve_format(fmt)](records, output_file)
+
+def export_csv_file(csv_file, fmt):
+    """
+    Converts a validated statement CSV to fmt, reusing an export that is newer than the CSV.
+
+    Args:
+        csv_file (str): Path of a CSV written by post_processing.write_validated_csv
+        fmt (str): One of EXPORT_FORMATS
+
+    Returns:
+        str: Path of the exported file
+    """
+    fmt = resolve_format(fmt)
+    if fmt == 'csv':
+        return csv_file
+    path = export_path(csv_file, fmt)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(csv_file):
+        return path
+
+    # Unique per call: threads of one web worker may convert the same CSV at the same time
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        with open(csv_file, 'r', newline='') as f:
+            for _ in stream_export(csv.DictReader(f), tmp_path, fmt):
+                pass
+        # Atomic rename so a concurrent download never sees a half-written file
+        os.replace(tmp_path, path)
+    finally:
+        # Left behind only when the conversion failed
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
@@ -0,0 +1,147 @@
+import metrics
+import model_client
+import post_processing
+import prefilter
+
+# Backend used when neither the request nor the bank template picks one
+DEFAULT_BACKEND = "llm"
+
+# Backend per known bank layout; banks not listed here use DEFAULT_BACKEND
+BANK_TEMPLATES = {
+    "brac": "rules",  # one transaction per line: date, description, amount, balance
+}
+
+class ExtractionBackend:
+    """
+    Turns OCR text into transaction lines, one per line, in statement order.
+
+    extract(text, progress) may call progress(units_done, unit_count) as it goes.
+    stream(text, progress) yields the same lines one by one as they become known.
+    """
+
+    name = None
+    version = None
+
+    def extract(self, text, progress=None):
+        raise NotImplementedError
+
+    def stream(self, text, progress=None):
+        yield from self.extract(text, progress=progress).splitlines()
+
+class LLMBackend(ExtractionBackend):
+    """
+    The causal LM, fed only the lines the regex prefilter can't decide. Runs in the model
+    server when MODEL_SERVER_URL is set, otherwise in this process (model.py).
+    """
+
+    name = "llm"
+
+    @staticmethod
+    def _model():
+        if model_client.MODEL_SERVER_URL:
+            return model_client
+        # Imported lazily so workers that only use other backends or the server never load torch
+        import model
+        return model
+
+    @property
+    def version(self):
+        if model_client.MODEL_SERVER_URL:
+            return f"prefilter-2|llm-2|{model_client.model_version()}"
+        import model
+        version = f"prefilter-2|llm-2|{model.model_path}|{model.model_precision}"
+        # Constrained decoding can change the lines, so its results are cached separately
+        return f"{version}|constrained" if model.CONSTRAINED_DECODING else version
+
+    @staticmethod
+    def _prefilter(text):
+        # Keep certain transaction lines, drop certain noise, and send only ambiguous lines to the LLM
+        with metrics.timed('prefilter'):
+            filtered = prefilter.prefilter(text)
+        stats = filtered['stats']
+        metrics.count('prefilter_tokens_saved', stats['tokens_saved'])
+        print(f"Prefilter: {stats['transaction_lines']} transaction, {stats['noise_lines']} noise, "
+              f"{stats['ambiguous_lines']} ambiguous lines; LLM input tokens {stats['tokens_before']} -> "
+              f"{stats['tokens_after']} ({stats['tokens_saved']} saved)")
+        return filtered
+
+    def extract(self, text, progress=None):
+        model = self._model()
+        filtered = self._prefilter(text)
+        if filtered['ambiguous_text']:
+            llm_output = model.extract_transactions(filtered['ambiguous_text'], progress=progress)
+        else:
+            llm_output = ""
+            if progress:
+                progress(1, 1)
+        return prefilter.merge_with_llm_output(filtered, llm_output)
+
+    def stream(self, text, progress=None):
+        model = self._model()
+        filtered = self._prefilter(text)
+        if filtered['ambiguous_text']:
+            llm_lines = model.stream_transactions(filtered['ambiguous_text'], progress=progress)
+        else:
+            llm_lines = []
+            if progress:
+                progress(1, 1)
+        yield from prefilter.iter_merge_with_llm_lines(filtered, llm_lines)
+
+class RuleBackend(ExtractionBackend):
+    """
+    Pure regex layout parser for statements with one transaction per line.
+
+    A line is kept when, after the same clean-up post_processing applies, it starts with a
+    DD-MMM-YYYY date and the validator's balance and amount patterns both find a number.
+    """
+
+    name = "rules"
+    version = "rules-1"
+
+    def extract(self, text, progress=None):
+        lines = []
+        for line in text.splitlines():
+            if self.is_transaction_line(line):
+                lines.append(line.strip())
+        if progress:
+            progress(1, 1)
+        return "\n".join(lines)
+
+    @staticmethod
+    def is_transaction_line(line):
+        stripped = prefilter.LEADING_SYMBOLS.sub('', line).strip()
+        date_match = post_processing.DATE_PATTERN.match(stripped)
+        if not date_match:
+            return False
+        cleaned = next(post_processing.clean_bank_statement([stripped]))
+        remaining = cleaned[len(date_match.group(1)):].strip()
+
+        balance_match = post_processing.BALANCE_PATTERN.search(remaining)
+        if not balance_match:
+            return False
+        remaining = remaining[:remaining.rfind(balance_match.group(1))].strip()
+        return post_processing.AMOUNT_PATTERN.search(remaining) is not None
+
+BACKENDS = {
+    LLMBackend.name: LLMBackend,
+    RuleBackend.name: RuleBackend,
+}
+
+def get_backend(name=None, bank=None):
+    """
+    Picks the extraction backend for a request.
+
+    Args:
+        name (str): Backend requested explicitly ('llm' or 'rules'); wins over the bank template.
+        bank (str): Bank template name, looked up in BANK_TEMPLATES.
+
+    Returns:
+        ExtractionBackend: A backend instance.
+    """
+    if not name and bank:
+        name = BANK_TEMPLATES.get(bank.lower())
+    if not name:
+        name = DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown extraction backend: {name}")
+    return BACKENDS[name]()
@@ -0,0 +1,425 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+import metrics
+
+# A running job whose heartbeat is older than this is assumed to have lost its worker and is queued again
+STALE_AFTER_SECONDS = 300
+# Times a job is started before it is failed instead of queued again (a statement that kills its worker,
+# e.g. by running out of memory, would otherwise be retried forever)
+MAX_ATTEMPTS = 3
+HEARTBEAT_SECONDS = 30
+POLL_SECONDS = 1.0
+# Validated rows are stored ROW_BATCH at a time, or sooner once ROW_FLUSH_SECONDS have passed since the
+# last write; progress counters are written at most every PROGRESS_SECONDS, and whenever the stage changes
+ROW_BATCH = 200
+ROW_FLUSH_SECONDS = 0.25
+PROGRESS_SECONDS = 0.5
+# Scheduling priority of job threads (Linux nice value), so the web requests of the same worker process
+# keep getting CPU while a statement is processed; OCR processes started by the job inherit it
+JOB_NICENESS = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    options TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    metrics TEXT,
+    cost INTEGER NOT NULL DEFAULT 1,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_username ON jobs (username, created_at);
+CREATE TABLE IF NOT EXISTS job_rows (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    row TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+class JobStore:
+    """SQLite-backed job table shared by every web worker process."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            # Databases created before per-job metrics existed
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'metrics' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN metrics TEXT")
+            if 'cost' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN cost INTEGER NOT NULL DEFAULT 1")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def create(self, username, filename, file_path, options=None, cost=1, check=None):
+        """
+        Queues a new job and returns its id. cost is its estimated size in pages (see admission.py).
+
+        If check is given, it is called as check(load) inside the transaction that inserts the job,
+        where load(window_seconds) returns self.load(username, window_seconds) as seen by that
+        transaction. Whatever check raises is re-raised and the job is not created, so concurrent
+        uploads can't all be admitted against the same load.
+        """
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if check is not None:
+                    check(lambda window_seconds: self._load(conn, username, window_seconds))
+                now = time.time()
+                conn.execute(
+                    "INSERT INTO jobs (id, username, filename, file_path, options, status, stage, cost, created_at, "
+                    "updated_at) VALUES (?, ?, ?, ?, ?, 'queued', 'queued', ?, ?, ?)",
+                    (job_id, username, filename, file_path, json.dumps(options or {}), cost, now, now)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def get(self, job_id):
+        """Returns the job as a dict (options, progress and result decoded), or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['options'] = json.loads(job['options'])
+        job['progress'] = json.loads(job['progress'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['metrics'] = json.loads(job['metrics']) if job['metrics'] else None
+        return job
+
+    def claim(self, max_running=None):
+        """
+        Atomically moves the oldest queued job to 'running' and returns it, or None.
+        Running jobs whose worker stopped sending heartbeats are put back in the queue first,
+        or failed once they have been started MAX_ATTEMPTS times.
+        With max_running, nothing is claimed while that many jobs are running in any process.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', stage = 'failed', error = ?, updated_at = ? "
+                    "WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+                    (f"The worker processing this statement stopped {MAX_ATTEMPTS} times", now,
+                     now - STALE_AFTER_SECONDS, MAX_ATTEMPTS)
+                )
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', stage = 'queued' WHERE status = 'running' AND updated_at < ?",
+                    (now - STALE_AFTER_SECONDS,)
+                )
+                row = None
+                running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+                if max_running is None or running < max_running:
+                    row = conn.execute(
+                        "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                    ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (now, row['id'])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return self.get(row['id'])
+
+    def update_progress(self, job_id, stage, **progress):
+        """Records the current stage and merges the given counters into the job's progress."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET stage = ?, progress = json_patch(progress, ?), updated_at = ? WHERE id = ?",
+                (stage, json.dumps(progress), time.time(), job_id)
+            )
+
+    def add_rows(self, job_id, rows):
+        """Stores [(seq, row), ...] in one transaction."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("INSERT OR REPLACE INTO job_rows (job_id, seq, row) VALUES (?, ?, ?)",
+                                 [(job_id, seq, json.dumps(row)) for seq, row in rows])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def store_rows(self, job_id, rows):
+        """
+        Stores a job's validated rows as they are produced, for streaming to the browser. Rows
+        are written ROW_BATCH at a time, or as soon as ROW_FLUSH_SECONDS have passed since the
+        last write, so rows that trickle in while the model generates still show up right away.
+
+        Args:
+            job_id (str): The job the rows belong to.
+            rows (iterable): Validated row dicts, numbered from 1 in this order.
+
+        Returns:
+            int: Number of rows stored
+        """
+        pending = []
+        written = time.monotonic()
+        count = 0
+        for count, row in enumerate(rows, 1):
+            pending.append((count, row))
+            if len(pending) >= ROW_BATCH or time.monotonic() - written >= ROW_FLUSH_SECONDS:
+                self.add_rows(job_id, pending)
+                pending = []
+                written = time.monotonic()
+        if pending:
+            self.add_rows(job_id, pending)
+        return count
+
+    def clear_rows(self, job_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM job_rows WHERE job_id = ?", (job_id,))
+
+    def rows_after(self, job_id, seq, limit=-1):
+        """Returns [(seq, row), ...] for the rows stored after the given sequence number (at most limit)."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT seq, row FROM job_rows WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                                (job_id, seq, limit)).fetchall()
+        return [(r['seq'], json.loads(r['row'])) for r in rows]
+
+    def iter_rows(self, job_id, page_size=500):
+        """Yields a job's stored rows in order, reading page_size rows at a time."""
+        seq = 0
+        while True:
+            page = self.rows_after(job_id, seq, page_size)
+            for seq, row in page:
+                yield row
+            if len(page) < page_size:
+                return
+
+    def heartbeat(self, job_ids):
+        if not job_ids:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'",
+                [(time.time(), job_id) for job_id in job_ids]
+            )
+
+    def set_metrics(self, job_id, job_metrics):
+        """Stores a job's timing breakdown (metrics.RequestMetrics.as_dict())."""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET metrics = ? WHERE id = ?", (json.dumps(job_metrics), job_id))
+
+    def metrics_summary(self):
+        """
+        Totals over every job that has recorded metrics, for the Prometheus endpoint. Read from
+        the database so every web worker process reports the same numbers.
+
+        Returns:
+            dict: 'jobs' {status: count}, 'seconds' {stage: total}, 'calls' {stage: total},
+                  'counters' {name: total} and 'peak_rss_mb' (largest seen)
+        """
+        summary = {}
+        with self._connect() as conn:
+            summary['jobs'] = {row['status']: row['n'] for row in conn.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+            for key in ('seconds', 'calls', 'counters'):
+                summary[key] = {row['key']: row['total'] for row in conn.execute(
+                    f"SELECT e.key AS key, SUM(e.value) AS total FROM jobs, json_each(jobs.metrics, '$.{key}') AS e "
+                    "WHERE jobs.metrics IS NOT NULL GROUP BY e.key")}
+            summary['peak_rss_mb'] = conn.execute(
+                "SELECT MAX(json_extract(metrics, '$.peak_rss_mb')) FROM jobs WHERE metrics IS NOT NULL"
+            ).fetchone()[0]
+        return summary
+
+    def owns_output(self, username, csv_file):
+        """True if csv_file is the output CSV of one of the user's finished jobs."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM jobs WHERE username = ? AND status = 'done' AND json_extract(result, '$.csv_file') = ? "
+                "LIMIT 1",
+                (username, csv_file)
+            ).fetchone()
+        return row is not None
+
+    def load(self, username, window_seconds):
+        """
+        Current load, for admission control: every user's queued and running jobs and pages, this
+        user's share of them, and the pages this user submitted in the last window_seconds.
+
+        Returns:
+            dict: running, queued, active_pages, user_active, user_active_pages, user_window_pages,
+                  user_window_start (created_at of the user's oldest job in the window, or None)
+                  and seconds_per_page (average over the jobs finished in the window, or None)
+        """
+        with self._connect() as conn:
+            return self._load(conn, username, window_seconds)
+
+    def _load(self, conn, username, window_seconds):
+        since = time.time() - window_seconds
+        load = dict(conn.execute(
+            "SELECT COALESCE(SUM(status = 'running'), 0) AS running, COALESCE(SUM(status = 'queued'), 0) AS queued, "
+            "COALESCE(SUM(cost), 0) AS active_pages, COALESCE(SUM(username = ?), 0) AS user_active, "
+            "COALESCE(SUM(CASE WHEN username = ? THEN cost END), 0) AS user_active_pages "
+            "FROM jobs WHERE status IN ('queued', 'running')",
+            (username, username)
+        ).fetchone())
+        window = conn.execute(
+            "SELECT COALESCE(SUM(cost), 0) AS pages, MIN(created_at) AS start FROM jobs "
+            "WHERE username = ? AND created_at >= ?",
+            (username, since)
+        ).fetchone()
+        speed = conn.execute(
+            "SELECT SUM(json_extract(metrics, '$.seconds.total')) AS seconds, SUM(cost) AS pages FROM jobs "
+            "WHERE status = 'done' AND metrics IS NOT NULL AND updated_at >= ?",
+            (since,)
+        ).fetchone()
+        load['user_window_pages'] = window['pages']
+        load['user_window_start'] = window['start']
+        load['seconds_per_page'] = speed['seconds'] / speed['pages'] if speed['seconds'] and speed['pages'] else None
+        return load
+
+    def finish(self, job_id, result):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', stage = 'done', result = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(result), time.time(), job_id)
+            )
+
+    def fail(self, job_id, error):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', stage = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (error, time.time(), job_id)
+            )
+
+class _ThrottledProgress:
+    """A job's progress(stage, **counters) callback, writing to the store at most every PROGRESS_SECONDS."""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.stage = None
+        self.pending = {}
+        self.written = 0.0
+
+    def __call__(self, stage, **counters):
+        self.pending.update(counters)
+        if stage != self.stage or time.monotonic() - self.written >= PROGRESS_SECONDS:
+            self.stage = stage
+            self.flush()
+
+    def flush(self):
+        """Writes the counters collected since the last write."""
+        if self.stage is None:
+            return
+        self.store.update_progress(self.job_id, self.stage, **self.pending)
+        self.pending = {}
+        self.written = time.monotonic()
+
+class JobRunner:
+    """
+    Background worker threads that claim queued jobs from a JobStore and run them.
+
+    The handler is called as handler(job, progress) where progress(stage, **counters)
+    records per-stage progress; its return value is stored as the job result, and the
+    stage timings it records through metrics.py as the job's metrics.
+    Every web worker process can run its own JobRunner against the same database.
+    """
+
+    def __init__(self, store, handler, workers=1, max_running=None):
+        """
+        Args:
+            store (JobStore): Where jobs are claimed from.
+            handler (callable): Runs one job, see above.
+            workers (int): Job threads in this process.
+            max_running (int): Most jobs running at once across every process sharing the store.
+        """
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.max_running = max_running
+        self._running = set()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True).start()
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def _work(self):
+        if hasattr(os, 'setpriority'):
+            try:
+                # On Linux a thread's native id is a valid target, so only the job threads are deprioritized
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), JOB_NICENESS)
+            except OSError:
+                pass
+        while True:
+            try:
+                job = self.store.claim(self.max_running)
+            except sqlite3.Error:
+                traceback.print_exc()
+                job = None
+            if job is None:
+                time.sleep(POLL_SECONDS)
+                continue
+
+            with self._lock:
+                self._running.add(job['id'])
+            job_metrics = metrics.RequestMetrics()
+            progress = _ThrottledProgress(self.store, job['id'])
+            try:
+                with metrics.recording(job_metrics):
+                    result = self.handler(job, progress)
+                progress.flush()
+                self.store.set_metrics(job['id'], job_metrics.as_dict())
+                self.store.finish(job['id'], result)
+            except Exception as e:
+                traceback.print_exc()
+                self.store.set_metrics(job['id'], job_metrics.as_dict())
+                self.store.fail(job['id'], str(e))
+            finally:
+                with self._lock:
+                    self._running.discard(job['id'])
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            with self._lock:
+                running = list(self._running)
+            try:
+                self.store.heartbeat(running)
+            except sqlite3.Error:
+                traceback.print_exc()
@@ -0,0 +1,207 @@
+"""
+Per-request timing instrumentation for the pipeline.
+
+A request (one job, or one model server call) is recorded by wrapping it in recording();
+code anywhere below it on the same thread adds stage durations with timed()/add_time()
+and counters (pages, tokens in/out, rows...) with count(). Nothing is recorded when no
+recording is active, so the helpers can be called unconditionally.
+
+While a recording is active, the process's resident memory is sampled every
+RSS_SAMPLE_SECONDS, so each request reports the peak RSS seen while it ran rather than the
+process's lifetime high-water mark.
+"""
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_local = threading.local()
+
+# How often resident memory is sampled while any recording is active
+RSS_SAMPLE_SECONDS = 0.2
+
+_sampled = set()
+_sampler_lock = threading.Lock()
+_sampler = None
+
+class RequestMetrics:
+    """Stage durations (seconds), call counts and counters of one request."""
+
+    def __init__(self):
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.counters = collections.defaultdict(int)
+        self.peak_rss_mb = None
+
+    def sample_rss(self, rss_mb):
+        if rss_mb is not None and (self.peak_rss_mb is None or rss_mb > self.peak_rss_mb):
+            self.peak_rss_mb = rss_mb
+
+    def add_time(self, stage, seconds, calls=1):
+        self.seconds[stage] += seconds
+        self.calls[stage] += calls
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def merge(self, other):
+        """Adds the stages and counters of another request's as_dict() (e.g. from the model server)."""
+        for stage, seconds in other.get('seconds', {}).items():
+            if stage == 'total':  # the other side's wall time is already inside one of our stages
+                continue
+            self.add_time(stage, seconds, other.get('calls', {}).get(stage, 1))
+        for name, value in other.get('counters', {}).items():
+            self.count(name, value)
+
+    def as_dict(self):
+        """
+        JSON-serializable summary, with tokens/sec of decoding and the peak RSS of this process
+        while the request was recorded (the lifetime peak where RSS can't be sampled).
+        """
+        decode_seconds = self.seconds.get('llm.decode', 0)
+        return {
+            'seconds': {stage: round(seconds, 4) for stage, seconds in self.seconds.items()},
+            'calls': dict(self.calls),
+            'counters': dict(self.counters),
+            'tokens_per_second': round(self.counters.get('tokens_out', 0) / decode_seconds, 2)
+                                 if decode_seconds else None,
+            'peak_rss_mb': self.peak_rss_mb if self.peak_rss_mb is not None else peak_rss_mb(),
+            'children_peak_rss_mb': peak_rss_mb(children=True),
+        }
+
+def peak_rss_mb(children=False):
+    """
+    Lifetime peak resident memory of this process (or of its largest finished child process,
+    e.g. an OCR worker).
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def current_rss_mb():
+    """Resident memory of this process right now, or None where /proc isn't available."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+
+def _sample_rss():
+    while True:
+        rss_mb = current_rss_mb()
+        with _sampler_lock:
+            for metrics in _sampled:
+                metrics.sample_rss(rss_mb)
+        time.sleep(RSS_SAMPLE_SECONDS)
+
+def _start_sampling(metrics):
+    global _sampler
+    rss_mb = current_rss_mb()
+    if rss_mb is None:
+        return
+    metrics.sample_rss(rss_mb)
+    with _sampler_lock:
+        _sampled.add(metrics)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_rss, name="rss-sampler", daemon=True)
+            _sampler.start()
+
+def _stop_sampling(metrics):
+    with _sampler_lock:
+        _sampled.discard(metrics)
+    metrics.sample_rss(current_rss_mb())
+
+def current():
+    """The RequestMetrics being recorded on this thread, or None."""
+    return getattr(_local, 'metrics', None)
+
+@contextlib.contextmanager
+def recording(metrics=None):
+    """Records everything measured on this thread inside the block into one RequestMetrics."""
+    previous = current()
+    _local.metrics = metrics or RequestMetrics()
+    _start_sampling(_local.metrics)
+    start = time.perf_counter()
+    try:
+        yield _local.metrics
+    finally:
+        _local.metrics.add_time('total', time.perf_counter() - start)
+        _stop_sampling(_local.metrics)
+        _local.metrics = previous
+
+def add_time(stage, seconds, calls=1):
+    metrics = current()
+    if metrics is not None:
+        metrics.add_time(stage, seconds, calls)
+
+def count(name, value=1):
+    metrics = current()
+    if metrics is not None:
+        metrics.count(name, value)
+
+def merge(other):
+    metrics = current()
+    if metrics is not None and other:
+        metrics.merge(other)
+
+@contextlib.contextmanager
+def timed(stage):
+    """Adds the time spent inside the block to stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(stage, time.perf_counter() - start)
+
+class IterTimer:
+    """
+    Wraps an iterator and adds up the time spent producing its items, but not the time the
+    caller spends between them, so a stage in a chain of generators can be measured on its own.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+def render_prometheus(families):
+    """
+    Formats metrics in the Prometheus text exposition format.
+
+    Args:
+        families (list): (name, type, help, samples) tuples, where samples is a list of
+            (labels dict, value) pairs
+
+    Returns:
+        str: The /metrics response body
+    """
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in sorted(labels.items()))
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
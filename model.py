@@ -93,30 +93,138 @@
 
 # model.py
 
+import collections
+import copy
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, LogitsProcessorList, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+import constrained
+import metrics
+from batching import BatchScheduler
 
 # Path to the locally saved model directory
 model_path = "mistral"  # You can use full path like r"C:\models\mistral"
 
+# Weight precision on CPU: "float32" (~28 GB), "bfloat16" (~14 GB) or "int8" (dynamic quantization of the
+# Linear layers, ~7 GB). Check the effect on extracted lines with precision_check.py before switching.
+PRECISIONS = ("float32", "bfloat16", "int8")
+model_precision = os.environ.get("MODEL_PRECISION", "float32")
+
+# Chunked extraction: OCR tokens per prompt, lines repeated between split chunks, and new tokens per call
+CHUNK_MAX_TOKENS = 1024
+CHUNK_OVERLAP_LINES = 2
+MAX_NEW_TOKENS = 1500
+
+# Prefill the fixed instructions of build_prompt once and reuse their keys/values on every generate call
+USE_PREFIX_CACHE = os.environ.get("MODEL_PREFIX_CACHE", "1") != "0"
+
+# Speculative decoding for single prompts: "off", "prompt_lookup" (draft tokens copied from n-grams of the
+# prompt, which suits answers made of copied OCR lines) or "assisted" (draft tokens from the small model
+# at DRAFT_MODEL_PATH, which must share the tokenizer). The model checks every drafted token in one
+# forward pass and keeps only those greedy decoding would have picked. Batches always decode normally.
+DECODING_MODES = ("off", "prompt_lookup", "assisted")
+decoding_mode = os.environ.get("MODEL_DECODING", "off")
+PROMPT_LOOKUP_TOKENS = int(os.environ.get("MODEL_PROMPT_LOOKUP_TOKENS", "10"))
+PROMPT_LOOKUP_MAX_NGRAM = int(os.environ.get("MODEL_PROMPT_LOOKUP_NGRAM", "3"))
+DRAFT_MODEL_PATH = os.environ.get("MODEL_DRAFT_PATH")
+
+# Constrained decoding (constrained.py): the answer can only contain well-formed transaction lines and
+# ends when the model stops writing them or starts repeating itself, instead of running to MAX_NEW_TOKENS
+CONSTRAINED_DECODING = os.environ.get("MODEL_CONSTRAINED", "0") == "1"
+
+PAGE_MARKER = re.compile(r'^=== Page \d+ ===$', re.MULTILINE)
+
 # Caching model and tokenizer so they load only once
 model = None
 tokenizer = None
+loaded_precision = None
+
+# Token ids and past_key_values of PROMPT_PREFIX, set by load_model when USE_PREFIX_CACHE is on
+prefix_ids = None
+prefix_cache = None
+
+# Draft model of the "assisted" decoding mode, loaded by load_draft_model
+draft_model = None
+
+# Set by enable_batching(); when present, every generate call goes through the shared batch scheduler
+batch_scheduler = None
+
+# model.generate isn't safe to run from several threads at once on the same model, and each call holds
+# its own KV cache; without a batch scheduler, concurrent callers take turns
+_generate_lock = threading.Lock()
+
+def load_model(precision=None):
+    """
+    Lazily loads the model and tokenizer only once.
+
+    Args:
+        precision (str): One of PRECISIONS. None keeps whatever is loaded, or loads model_precision.
+    """
+    global model, tokenizer, loaded_precision, prefix_cache
+    if model is not None and tokenizer is not None and precision in (None, loaded_precision):
+        return
+
+    precision = precision or model_precision
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model precision: {precision} (expected one of {', '.join(PRECISIONS)})")
+    if decoding_mode not in DECODING_MODES:
+        raise ValueError(f"Unknown decoding mode: {decoding_mode} (expected one of {', '.join(DECODING_MODES)})")
+
+    print(f"Loading model in {precision}... (This may take time on CPU)")
+    model = None  # Drop any previously loaded copy before loading the next one
+    prefix_cache = None
+    model = AutoModelForCausalLM.from_pretrained(
+        model_path,
+        torch_dtype=torch.bfloat16 if precision == "bfloat16" else torch.float32,
+        low_cpu_mem_usage=True
+    ).to("cpu")
+    if precision == "int8":
+        # Weights stored as int8, activations quantized on the fly; runs on CPU without extra packages
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    # Batched prompts are padded on the left so every sequence continues from its own last token
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    loaded_precision = precision
+    if USE_PREFIX_CACHE:
+        build_prefix_cache()
+    print("Model loaded.")
+    if decoding_mode == "assisted":
+        load_draft_model()
+
+def load_draft_model():
+    """Loads the small draft model used by the "assisted" decoding mode, in the main model's dtype."""
+    global draft_model
+    if not DRAFT_MODEL_PATH:
+        raise ValueError("MODEL_DRAFT_PATH must point to a draft model for assisted decoding")
+    print(f"Loading draft model from {DRAFT_MODEL_PATH}...")
+    draft_model = AutoModelForCausalLM.from_pretrained(
+        DRAFT_MODEL_PATH,
+        torch_dtype=torch.bfloat16 if loaded_precision == "bfloat16" else torch.float32,
+        low_cpu_mem_usage=True
+    ).to("cpu")
+    draft_model.eval()
+
+def build_prefix_cache():
+    """Runs the static instruction block of the prompt through the model once and keeps its past_key_values."""
+    global prefix_ids, prefix_cache
+    prefix_ids = tokenizer(PROMPT_PREFIX, return_tensors="pt")["input_ids"].to(model.device)
+    with torch.no_grad():
+        prefix_cache = model(prefix_ids, use_cache=True).past_key_values
+    print(f"Cached prompt prefix ({prefix_ids.shape[1]} tokens).")
 
-def load_model():
-    """Lazily loads the model and tokenizer only once."""
-    global model, tokenizer
-    if model is None or tokenizer is None:
-        print("Loading model... (This may take time on CPU)")
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            torch_dtype=torch.float32  # Use float32 for CPU
-        ).to("cpu")
-        tokenizer = AutoTokenizer.from_pretrained(model_path)
-        print("Model loaded.")
-
-def build_prompt(ocr_text):
-    return f"""You are a helpful assistant. Your task is to extract only the lines that represent financial transactions from the OCR bank statement text. These include debits, credits, interest payments, loan disbursements, recoveries, etc.
+# Everything before the OCR text is the same for every prompt, so its keys/values can be cached
+PROMPT_PREFIX = """You are a helpful assistant. Your task is to extract only the lines that represent financial transactions from the OCR bank statement text. These include debits, credits, interest payments, loan disbursements, recoveries, etc.
 
 Return only the transaction lines exactly as they appear, without explanation or extra formatting.
 
@@ -135,27 +243,390 @@ RAHMAN ELECTRIC AND HARDWARE Cust ID 04258873
 
 Now extract transaction lines from this text:
 
-{ocr_text}
+"""
+PROMPT_SUFFIX = """
 
 Transaction lines:"""
 
-def extract_transactions(text):
-    """Main callable function to extract transaction lines from OCR text using LLM."""
-    load_model()  # Lazy loading model on demand
-    prompt = build_prompt(text)
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+def build_prompt(ocr_text):
+    return PROMPT_PREFIX + ocr_text + PROMPT_SUFFIX
 
-    with torch.no_grad():
+def _answer(decoded):
+    if "Transaction lines:" in decoded:
+        return decoded.split("Transaction lines:")[-1].strip()
+    return decoded.strip()
+
+def _prompt_inputs(text):
+    """
+    Tokenizes one extraction prompt for generate. When the prompt's tokens start with the
+    cached prefix, a copy of its past_key_values goes along so only the OCR text is prefilled.
+    """
+    inputs = tokenizer(build_prompt(text), return_tensors="pt").to(model.device)
+    if prefix_cache is not None:
+        n = prefix_ids.shape[1]
+        input_ids = inputs["input_ids"]
+        if input_ids.shape[1] > n and torch.equal(input_ids[0, :n], prefix_ids[0]):
+            # generate appends to the cache in place, so each call works on its own copy
+            inputs["past_key_values"] = copy.deepcopy(prefix_cache)
+    return inputs
+
+class _GenerationClock(BaseStreamer):
+    """
+    Streamer that timestamps generate's steps, to split its time into prefill and decode.
+    generate puts the prompt first and then the tokens of each step, so the second put ends the prefill.
+    A step normally adds one token per sequence; with speculative decoding it can add several.
+    listeners (one per sequence, or None) receive each sequence's new token ids.
+    """
+
+    def __init__(self, listeners=None):
+        self.listeners = listeners
+        self.started = time.perf_counter()
+        self.prefill_done = None
+        self.ended = None
+        self._prompt_seen = False
+        self.steps = 0
+
+    def put(self, value):
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        self.steps += 1
+        if self.steps == 1:
+            self.prefill_done = time.perf_counter()
+        if self.listeners:
+            # Plain decoding puts one token per sequence (shape [batch]), speculative decoding [1, n] tokens
+            rows = value.tolist() if value.dim() > 1 else [[token] for token in value.tolist()]
+            for listener, token_ids in zip(self.listeners, rows):
+                if listener is not None:
+                    listener(token_ids)
+
+    def end(self):
+        self.ended = time.perf_counter()
+
+    def stats(self, tokens_in, tokens_out, tokens_cached):
+        ended = self.ended or time.perf_counter()
+        prefill_done = self.prefill_done or ended
+        return {
+            'tokens_in': tokens_in,
+            'tokens_out': tokens_out,
+            'tokens_cached': tokens_cached,
+            'decode_steps': self.steps,
+            'prefill_seconds': prefill_done - self.started,
+            'decode_seconds': ended - prefill_done,
+        }
+
+class _LineStream:
+    """
+    Collects one sequence's token ids as generate produces them (put, on the generating thread)
+    and yields the complete lines of its answer (lines, on the reading thread).
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def put(self, token_ids):
+        self._queue.put(token_ids)
+
+    def close(self, future=None):
+        self._queue.put(None)
+
+    def lines(self):
+        token_ids, printed, buffer = [], 0, ""
+        while True:
+            new_ids = self._queue.get()
+            if new_ids is not None:
+                token_ids.extend(new_ids)
+            # Tokens are decoded from the start of the current line, so pieces join up with the right spacing
+            text = tokenizer.decode(token_ids, skip_special_tokens=True)
+            if new_ids is not None and text.endswith("\ufffd"):
+                continue  # part of a multi-byte character, wait for the rest
+            buffer += text[printed:]
+            token_ids, printed = ([], 0) if text.endswith("\n") else (token_ids, len(text))
+            *complete, buffer = buffer.split("\n")
+            for line in complete:
+                if line.strip():
+                    yield line.strip()
+            if new_ids is None:
+                break
+        if buffer.strip():
+            yield buffer.strip()
+
+def _record_generation(stats):
+    # Runs on the requesting thread, so the numbers land in that request's metrics
+    metrics.add_time('llm.prefill', stats['prefill_seconds'])
+    metrics.add_time('llm.decode', stats['decode_seconds'])
+    metrics.count('tokens_in', stats['tokens_in'])
+    metrics.count('tokens_out', stats['tokens_out'])
+    metrics.count('tokens_cached', stats['tokens_cached'])
+    metrics.count('decode_steps', stats['decode_steps'])
+
+def _cached_tokens(inputs):
+    return prefix_ids.shape[1] if "past_key_values" in inputs else 0
+
+def _decoding_kwargs(batch_size=1):
+    """Extra generate arguments of decoding_mode; assisted generation only supports one sequence."""
+    if batch_size > 1 or decoding_mode == "off":
+        return {}
+    if decoding_mode == "prompt_lookup":
+        return {"prompt_lookup_num_tokens": PROMPT_LOOKUP_TOKENS, "max_matching_ngram_size": PROMPT_LOOKUP_MAX_NGRAM}
+    if draft_model is None:
+        load_draft_model()
+    return {"assistant_model": draft_model}
+
+def _constraint_kwargs(inputs):
+    """logits_processor/stopping_criteria arguments of generate when CONSTRAINED_DECODING is on."""
+    if not CONSTRAINED_DECODING:
+        return {}
+    prompt_length = inputs["input_ids"].shape[1]
+    return {
+        "logits_processor": LogitsProcessorList([
+            constrained.TransactionLineProcessor(tokenizer, prompt_length, tokenizer.eos_token_id)]),
+        "stopping_criteria": StoppingCriteriaList([
+            constrained.RepeatedLineStoppingCriteria(tokenizer, prompt_length)]),
+    }
+
+def generate_batch(texts):
+    """Runs several extraction prompts as one padded generate call and returns one answer per text."""
+    return [answer for answer, _ in _run_batch(texts)]
+
+def _run_batch(texts, listeners=None):
+    """
+    generate_batch that also returns each prompt's generation stats, as (answer, stats) pairs.
+    listeners, if given, has one callable (or None) per text that receives its new token ids
+    while generate runs.
+    """
+    if len(texts) == 1:
+        inputs = _prompt_inputs(texts[0])
+    else:
+        # Left padding shifts where the prefix sits in each row, so batches prefill the whole prompt
+        prompts = [build_prompt(text) for text in texts]
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+
+    clock = _GenerationClock(listeners)
+    with _generate_lock, torch.no_grad():
         output = model.generate(
             **inputs,
-            max_new_tokens=1500,
+            max_new_tokens=MAX_NEW_TOKENS,
             temperature=0.2,
             do_sample=False,
-            pad_token_id=tokenizer.eos_token_id
+            pad_token_id=tokenizer.pad_token_id,
+            streamer=clock,
+            **_decoding_kwargs(len(texts)),
+            **_constraint_kwargs(inputs)
         )
 
-    decoded = tokenizer.decode(output[0], skip_special_tokens=True)
+    # Prefill and decode times are the whole batch's, as experienced by every prompt in it
+    tokens_in = inputs["attention_mask"].sum(dim=1).tolist()
+    generated = output[:, inputs["input_ids"].shape[1]:]
+    tokens_out = (generated != tokenizer.pad_token_id).sum(dim=1).tolist()
+    cached = _cached_tokens(inputs)
+    # Only the new tokens are decoded; _answer still drops anything up to a repeated "Transaction lines:"
+    answers = [_answer(decoded) for decoded in tokenizer.batch_decode(generated, skip_special_tokens=True)]
+    return [(answer, clock.stats(n_in, n_out, cached)) for answer, n_in, n_out in zip(answers, tokens_in, tokens_out)]
+
+def _generate(text):
+    """Runs one extraction prompt through the model and returns the text after "Transaction lines:"."""
+    if batch_scheduler is not None:
+        answer, stats = batch_scheduler.submit(text).result()
+    else:
+        answer, stats = _run_batch([text])[0]
+    _record_generation(stats)
+    return answer
+
+def _start_stream(text):
+    """
+    Starts generating one prompt and returns (_LineStream of its answer, Future of its
+    (answer, stats)). The prompt is generated like any other: through the batch scheduler when
+    there is one, so it can share a batch with other prompts, otherwise on a thread of its own
+    that waits for _generate_lock.
+    """
+    stream = _LineStream()
+    if batch_scheduler is not None:
+        future = batch_scheduler.submit(text, stream.put)
+    else:
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(_run_batch([text], [stream.put])[0])
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+    future.add_done_callback(stream.close)
+    return stream, future
+
+def _stream_generate(stream, future):
+    """Yields the lines of a prompt started with _start_stream while generate is still running."""
+    yield from stream.lines()
+    answer, stats = future.result()
+    _record_generation(stats)
+
+def enable_batching(window_ms=50, max_batch=4, max_tokens=16384):
+    """
+    Routes all generation through a BatchScheduler, so prompts submitted concurrently (by
+    different requests, or the chunks of one statement) share generate calls.
+    """
+    global batch_scheduler
+    load_model()
+    batch_scheduler = BatchScheduler(
+        _run_batch,
+        count_tokens=lambda text: _count_tokens(build_prompt(text)),
+        window_ms=window_ms,
+        max_batch=max_batch,
+        max_tokens=max_tokens
+    )
+    return batch_scheduler
+
+def _count_tokens(text):
+    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+def split_into_chunks(text, max_tokens=CHUNK_MAX_TOKENS, overlap_lines=CHUNK_OVERLAP_LINES):
+    """
+    Splits OCR text into chunks of at most max_tokens tokens.
+
+    Whole pages (delimited by the "=== Page N ===" markers) are packed together while they
+    fit; a page that is larger than the budget on its own is split on line boundaries,
+    repeating the last overlap_lines lines at the start of the next piece so that a
+    transaction cut at the boundary is still seen whole by one of them.
+    """
+    pages = [p.strip() for p in PAGE_MARKER.split(text) if p.strip()]
+
+    chunks = []
+    current, current_tokens = [], 0
+    for page in pages:
+        page_tokens = _count_tokens(page)
+        if page_tokens > max_tokens:
+            if current:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_lines(page, max_tokens, overlap_lines))
+        elif current_tokens + page_tokens > max_tokens and current:
+            chunks.append("\n".join(current))
+            current, current_tokens = [page], page_tokens
+        else:
+            current.append(page)
+            current_tokens += page_tokens
+    if current:
+        chunks.append("\n".join(current))
+
+    return chunks
+
+def _split_lines(page, max_tokens, overlap_lines):
+    pieces = []
+    lines = page.splitlines()
+    start = 0
+    while start < len(lines):
+        end, tokens = start, 0
+        while end < len(lines):
+            line_tokens = _count_tokens(lines[end]) + 1
+            if tokens + line_tokens > max_tokens and end > start:
+                break
+            tokens += line_tokens
+            end += 1
+        pieces.append("\n".join(lines[start:end]))
+        if end >= len(lines):
+            break
+        start = max(end - overlap_lines, start + 1)
+    return pieces
+
+def _shared_line_count(previous_chunk, chunk):
+    """Number of source lines chunk repeats from the end of previous_chunk (see _split_lines)."""
+    if previous_chunk is None:
+        return 0
+    previous_lines, lines = previous_chunk.splitlines(), chunk.splitlines()
+    for count in range(min(CHUNK_OVERLAP_LINES, len(previous_lines), len(lines)), 0, -1):
+        if previous_lines[-count:] == lines[:count]:
+            return count
+    return 0
+
+def _merged_lines(chunks, outputs, progress=None):
+    """
+    Yields the lines of each chunk's output in order. Where a chunk starts with source lines the
+    previous chunk ended with, the transactions read from them come out of both; the copies at
+    the start of the later output are dropped. Identical lines anywhere else are separate
+    transactions and are all kept.
+
+    Args:
+        chunks (list): The chunks, as returned by split_into_chunks.
+        outputs (iterable): Each chunk's output lines, in chunk order.
+        progress (callable): If given, called as progress(chunks_done, chunk_count) after each chunk.
+    """
+    previous_chunk, previous_tail = None, []
+    for i, (chunk, output) in enumerate(zip(chunks, outputs)):
+        shared = _shared_line_count(previous_chunk, chunk)
+        # Each shared source line holds at most one transaction line
+        repeated = collections.Counter(previous_tail[len(previous_tail) - shared:] if shared else [])
+        tail = collections.deque(maxlen=CHUNK_OVERLAP_LINES)
+        at_start = True
+        for line in output:
+            key = " ".join(line.split())
+            if not key:
+                continue
+            tail.append(key)
+            if at_start and repeated[key]:
+                repeated[key] -= 1
+                continue
+            at_start = False
+            yield line.strip()
+        if progress:
+            progress(i + 1, len(chunks))
+        previous_chunk, previous_tail = chunk, list(tail)
+
+def merge_transaction_lines(chunks, outputs):
+    """Joins per-chunk outputs in order, dropping the lines repeated where neighbouring chunks overlap."""
+    return "\n".join(_merged_lines(chunks, (output.splitlines() for output in outputs)))
+
+def extract_transactions(text, chunked=True, progress=None):
+    """
+    Main callable function to extract transaction lines from OCR text using LLM.
+
+    With chunked=True the text is split into page-sized chunks (see split_into_chunks) and
+    each is extracted separately, so prompt length, memory and the output token limit
+    apply per chunk instead of to the whole statement. progress, if given, is called as
+    progress(chunks_done, chunk_count) as chunks complete.
+    """
+    load_model()  # Lazy loading model on demand
 
-    if "Transaction lines:" in decoded:
-        return decoded.split("Transaction lines:")[-1].strip()
-    return decoded.strip()
+    if not chunked:
+        output = _generate(text)
+        if progress:
+            progress(1, 1)
+        return output
+
+    chunks = split_into_chunks(text)
+    if batch_scheduler is not None:
+        # Submit every chunk up front so they can be batched together
+        futures = [batch_scheduler.submit(chunk) for chunk in chunks]
+        outputs = []
+        for future in futures:
+            answer, stats = future.result()
+            _record_generation(stats)
+            outputs.append(answer)
+            if progress:
+                progress(len(outputs), len(chunks))
+        return merge_transaction_lines(chunks, outputs)
+
+    outputs = []
+    for i, chunk in enumerate(chunks):
+        print(f"Extracting chunk {i + 1}/{len(chunks)}...")
+        outputs.append(_generate(chunk))
+        if progress:
+            progress(i + 1, len(chunks))
+    return merge_transaction_lines(chunks, outputs)
+
+def stream_transactions(text, chunked=True, progress=None):
+    """
+    Generator version of extract_transactions: yields each transaction line as soon as
+    the model has finished writing it, chunk after chunk, skipping the lines repeated where
+    neighbouring chunks overlap.
+    """
+    load_model()
+
+    chunks = split_into_chunks(text) if chunked else [text]
+    if batch_scheduler is not None:
+        # Submit every chunk up front so they can be batched together; their lines are still read in order
+        started = [_start_stream(chunk) for chunk in chunks]
+    else:
+        started = (_start_stream(chunk) for chunk in chunks)
+    yield from _merged_lines(chunks, (_stream_generate(stream, future) for stream, future in started), progress)
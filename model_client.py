@@ -0,0 +1,115 @@
+import http.client
+import json
+import os
+import threading
+from urllib.parse import urlsplit
+
+import metrics
+
+# Set to the model server's address (e.g. http://127.0.0.1:8500) to extract through it instead of
+# loading the model in this process
+MODEL_SERVER_URL = os.environ.get("MODEL_SERVER_URL")
+
+# Seconds to wait for one extraction; CPU generation of a long statement takes minutes
+MODEL_SERVER_TIMEOUT = float(os.environ.get("MODEL_SERVER_TIMEOUT", 900))
+
+# One keep-alive connection per thread
+_local = threading.local()
+_server_version = None
+
+def _connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        url = urlsplit(MODEL_SERVER_URL)
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=MODEL_SERVER_TIMEOUT)
+        _local.conn = conn
+    return conn
+
+def _drop_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+    _local.conn = None
+
+def _request(method, path, payload=None):
+    body = json.dumps(payload).encode('utf-8') if payload is not None else None
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+
+    # A kept-alive connection may have been closed by the server; retry once on a fresh one
+    for attempt in (1, 2):
+        conn = _connection()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = json.loads(response.read() or b'{}')
+        except (http.client.HTTPException, ConnectionError) as e:
+            _drop_connection()
+            if attempt == 2:
+                raise RuntimeError(f"Model server unavailable at {MODEL_SERVER_URL}: {e}") from e
+            continue
+        except OSError as e:  # includes timeouts, which are not retried
+            _drop_connection()
+            raise RuntimeError(f"Model server request failed: {e}") from e
+
+        if response.status != 200:
+            raise RuntimeError(f"Model server error {response.status}: {data.get('error', 'unknown error')}")
+        return data
+
+def model_version():
+    """
+    Returns "<model path>|<precision>" as reported by the server (fetched once per process),
+    followed by "|constrained" when the server uses constrained decoding.
+    """
+    global _server_version
+    if _server_version is None:
+        health = _request('GET', '/health')
+        _server_version = f"{health['model_path']}|{health['precision']}"
+        if health.get('constrained'):
+            _server_version += "|constrained"
+    return _server_version
+
+def extract_transactions(text, chunked=True, progress=None):
+    """
+    Same contract as model.extract_transactions, served by the model server process.
+    Chunk progress isn't visible from here, so progress is reported once, as 1 of 1.
+    """
+    response = _request('POST', '/extract', {'text': text, 'chunked': chunked})
+    metrics.merge(response.get('metrics'))
+    transactions = response['transactions']
+    if progress:
+        progress(1, 1)
+    return transactions
+
+def stream_transactions(text, chunked=True, progress=None):
+    """Same contract as model.stream_transactions; lines arrive as the server generates them."""
+    url = urlsplit(MODEL_SERVER_URL)
+    # Streaming responses end by closing the connection, so they don't use the kept-alive one
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=MODEL_SERVER_TIMEOUT)
+    try:
+        conn.request('POST', '/extract/stream', body=json.dumps({'text': text, 'chunked': chunked}).encode('utf-8'),
+                     headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        if response.status != 200:
+            raise RuntimeError(f"Model server error {response.status}")
+        complete = False
+        for raw in iter(response.readline, b''):
+            if not raw.endswith(b'\n'):  # cut off partway through a message
+                break
+            message = json.loads(raw)
+            if 'error' in message:
+                raise RuntimeError(f"Model server error: {message['error']}")
+            if 'metrics' in message:
+                metrics.merge(message['metrics'])
+                complete = True
+                continue
+            yield message['line']
+        # The server ends every stream with its metrics; without them it stopped mid-generation,
+        # and the lines so far must not be taken (and cached) as the whole statement
+        if not complete:
+            raise RuntimeError("Model server closed the stream early")
+    except OSError as e:
+        raise RuntimeError(f"Model server request failed: {e}") from e
+    finally:
+        conn.close()
+    if progress:
+        progress(1, 1)
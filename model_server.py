@@ -0,0 +1,118 @@
+"""
+Local inference server: one process owns the model and serves extraction requests for all web workers.
+
+Usage:
+    python model_server.py [--host 127.0.0.1] [--port 8500] [--precision int8] [--batch-window-ms 50]
+
+POST /extract/stream sends the lines back one JSON object per line while they are generated,
+followed by a {"metrics": ...} line with the request's prefill/decode times and token counts.
+Concurrent requests, streamed or not, are merged into batched generate calls by model.enable_batching;
+GET /metrics reports batch sizes and queue wait for tuning the window.
+
+Web workers reach it through model_client.py when MODEL_SERVER_URL is set.
+"""
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+import model
+
+MODEL_SERVER_HOST = "127.0.0.1"
+MODEL_SERVER_PORT = 8500
+
+class ModelRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep their connection open between requests
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {
+                'status': 'ok',
+                'model_path': model.model_path,
+                'precision': model.loaded_precision,
+                'constrained': model.CONSTRAINED_DECODING,
+            })
+        elif self.path == '/metrics':
+            self._send_json(200, model.batch_scheduler.metrics() if model.batch_scheduler else {})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path not in ('/extract', '/extract/stream'):
+            self._send_json(404, {'error': 'Not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            text = payload['text']
+        except (ValueError, KeyError):
+            self._send_json(400, {'error': 'Expected a JSON body with a "text" field'})
+            return
+
+        if self.path == '/extract/stream':
+            self._stream_lines(text, payload.get('chunked', True))
+            return
+
+        try:
+            # This thread only waits: every chunk is generated on the batch scheduler's thread, one batch at a time
+            with metrics.recording() as request_metrics:
+                transactions = model.extract_transactions(text, chunked=payload.get('chunked', True))
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        # Prefill/decode times and token counts travel back so the caller can add them to its job
+        self._send_json(200, {'transactions': transactions, 'metrics': request_metrics.as_dict()})
+
+    def _stream_lines(self, text, chunked):
+        # No Content-Length: the body ends when the connection closes
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            # Also generated on the batch scheduler's thread; the lines are read back as each batch runs
+            with metrics.recording() as request_metrics:
+                for line in model.stream_transactions(text, chunked=chunked):
+                    self.wfile.write(json.dumps({'line': line}).encode('utf-8') + b'\n')
+                    self.wfile.flush()
+            self.wfile.write(json.dumps({'metrics': request_metrics.as_dict()}).encode('utf-8') + b'\n')
+        except Exception as e:
+            self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8') + b'\n')
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(host=MODEL_SERVER_HOST, port=MODEL_SERVER_PORT, precision=None,
+          batch_window_ms=50, max_batch=4, max_batch_tokens=16384):
+    """Loads the model once, then serves requests until interrupted."""
+    model.load_model(precision)
+    model.enable_batching(window_ms=batch_window_ms, max_batch=max_batch, max_tokens=max_batch_tokens)
+    server = ThreadingHTTPServer((host, port), ModelRequestHandler)
+    server.daemon_threads = True
+    print(f"Model server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve transaction extraction from a single model process.")
+    parser.add_argument('--host', default=MODEL_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=MODEL_SERVER_PORT)
+    parser.add_argument('--precision', choices=model.PRECISIONS, help="Overrides MODEL_PRECISION")
+    parser.add_argument('--batch-window-ms', type=float, default=50,
+                        help="How long to wait for more prompts before running a batch")
+    parser.add_argument('--max-batch', type=int, default=4, help="Most prompts per generate call")
+    parser.add_argument('--max-batch-tokens', type=int, default=16384,
+                        help="Most padded prompt tokens per generate call")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.precision, args.batch_window_ms, args.max_batch, args.max_batch_tokens)
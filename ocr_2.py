@@ -1,28 +1,316 @@
-from pdf2image import convert_from_path
+import multiprocessing
+import os
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
 
+import metrics
+
 # Set the Tesseract executable path (Windows)
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
 # Set the Poppler binary path
 POPPLER_PATH = r"C:\Users\mosta\Downloads\Release-24.08.0-0\poppler-24.08.0\Library\bin"
 
-def ocr_pdf_to_text(pdf_path: str, lang: str = "eng") -> str:
+# A page's embedded text layer is trusted only if it has at least this many letters/digits
+MIN_TEXT_LAYER_CHARS = 32
+# ...and at least this share of its non-space characters are letters/digits (garbled font encodings fail this)
+MIN_TEXT_LAYER_ALNUM_RATIO = 0.5
+
+# Render resolution of the default (fixed) mode
+OCR_DPI = 300
+
+# Adaptive mode: pages are rendered in grayscale at ADAPTIVE_DPI and binarized, and only pages whose
+# mean Tesseract word confidence (0-100) falls below MIN_CONFIDENCE are OCR'd again at ADAPTIVE_RETRY_DPI
+ADAPTIVE_OCR = os.environ.get("OCR_ADAPTIVE", "0") == "1"
+ADAPTIVE_DPI = int(os.environ.get("OCR_ADAPTIVE_DPI", "200"))
+ADAPTIVE_RETRY_DPI = int(os.environ.get("OCR_ADAPTIVE_RETRY_DPI", "300"))
+MIN_CONFIDENCE = float(os.environ.get("OCR_MIN_CONFIDENCE", "85"))
+# Gray level (0-255) above which a pixel becomes white when binarizing
+BINARIZE_THRESHOLD = 180
+
+# Start method of the OCR process pools. They are created from job threads inside threaded web workers,
+# and a child forked from a multi-threaded process can deadlock on a lock another thread was holding, so
+# workers are forked from a single-threaded fork server instead (spawned where that isn't available).
+# The fork server preloads only this module, not the caller's __main__.
+if "forkserver" in multiprocessing.get_all_start_methods():
+    OCR_POOL_CONTEXT = multiprocessing.get_context("forkserver")
+    OCR_POOL_CONTEXT.set_forkserver_preload(["ocr_2"])
+else:
+    OCR_POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+def settings_version() -> str:
+    """The OCR settings that change its output, for cache keys (see pipeline.ocr_version)."""
+    if ADAPTIVE_OCR:
+        return f"adaptive-{ADAPTIVE_DPI}-{ADAPTIVE_RETRY_DPI}-{MIN_CONFIDENCE:g}-{BINARIZE_THRESHOLD}"
+    return f"dpi-{OCR_DPI}"
+
+def _init_ocr_worker():
+    """Keeps each pool worker's Tesseract single-threaded so processes don't oversubscribe the CPUs."""
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+def _ocr_image(args):
+    img, lang = args
+    return pytesseract.image_to_string(img, lang=lang)
+
+def binarize(img):
+    """Black and white copy of a page image; 1-bit pages are much smaller to hand to Tesseract."""
+    return img.convert("L").point(lambda value: 255 if value > BINARIZE_THRESHOLD else 0, mode="1")
+
+def ocr_with_confidence(img, lang: str = "eng"):
+    """
+    OCRs one image with image_to_data and returns (text, confidence), where confidence is the
+    mean word confidence (0-100), or None if Tesseract found no words. Lines are rebuilt from
+    the word boxes, with a blank line between paragraphs like image_to_string.
+    """
+    data = pytesseract.image_to_data(img, lang=lang, output_type=pytesseract.Output.DICT)
+    lines = []
+    confidences = []
+    current = None
+    for i, word in enumerate(data["text"]):
+        confidence = float(data["conf"][i])
+        if confidence < 0 or not word.strip():
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        if key == current:
+            lines[-1] += " " + word
+        else:
+            if current is not None and key[:2] != current[:2]:
+                lines.append("")
+            lines.append(word)
+            current = key
+        confidences.append(confidence)
+    return "\n".join(lines), sum(confidences) / len(confidences) if confidences else None
+
+def _ocr_page_window(args):
+    """
+    Rasterizes pages first..last only, OCRs them and frees each image before returning the texts,
+    the seconds spent rendering and in Tesseract (measured in the worker process), and one
+    {"dpi", "confidence", "retried"} dict per page.
+
+    With adaptive settings (retry_dpi, min_confidence) the pages are rendered in grayscale and
+    binarized, and a page below min_confidence is rendered again at retry_dpi and OCR'd in
+    grayscale, keeping whichever pass Tesseract is more confident about.
+    """
+    pdf_path, first, last, lang, poppler_path, dpi, adaptive = args
+    start = time.perf_counter()
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=first, last_page=last, poppler_path=poppler_path,
+                               grayscale=adaptive is not None)
+    render_seconds = time.perf_counter() - start
+
+    tesseract_seconds = 0.0
+    texts = []
+    pages = []
+    page = first
+    while images:
+        img = images.pop(0)
+        start = time.perf_counter()
+        if adaptive is None:
+            text, confidence = pytesseract.image_to_string(img, lang=lang), None
+        else:
+            text, confidence = ocr_with_confidence(binarize(img), lang=lang)
+        tesseract_seconds += time.perf_counter() - start
+        img.close()
+        info = {"dpi": dpi, "confidence": confidence, "retried": False}
+
+        if adaptive is not None and (confidence is None or confidence < adaptive[1]):
+            start = time.perf_counter()
+            retry_img = convert_from_path(pdf_path, dpi=adaptive[0], first_page=page, last_page=page,
+                                          poppler_path=poppler_path, grayscale=True)[0]
+            render_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            retry_text, retry_confidence = ocr_with_confidence(retry_img, lang=lang)
+            tesseract_seconds += time.perf_counter() - start
+            retry_img.close()
+            info["retried"] = True
+            if retry_confidence is not None and (confidence is None or retry_confidence > confidence):
+                text, info["dpi"], info["confidence"] = retry_text, adaptive[0], retry_confidence
+
+        texts.append(text)
+        pages.append(info)
+        page += 1
+    return texts, render_seconds, tesseract_seconds, pages
+
+def extract_text_layer(pdf_path: str, poppler_path: str | None = POPPLER_PATH) -> list[str]:
+    """
+    Returns the embedded text of every page using Poppler's pdftotext, or an empty list
+    if the tool is unavailable or the PDF can't be read. -layout keeps each statement row
+    on one line, the same shape Tesseract produces.
+    """
+    pdftotext = os.path.join(poppler_path, "pdftotext") if poppler_path else "pdftotext"
+    try:
+        result = subprocess.run([pdftotext, "-layout", "-enc", "UTF-8", pdf_path, "-"],
+                                capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    # pdftotext ends every page with a form feed, leaving an empty trailing chunk
+    if pages and not pages[-1].strip():
+        pages.pop()
+    return pages
+
+def has_text_layer(text: str) -> bool:
+    """Decides whether a page's extracted text is usable instead of OCR."""
+    chars = [c for c in text if not c.isspace()]
+    alnum = sum(1 for c in chars if c.isalnum())
+    return alnum >= MIN_TEXT_LAYER_CHARS and alnum >= MIN_TEXT_LAYER_ALNUM_RATIO * len(chars)
+
+def count_pages(pdf_path: str, poppler_path: str | None = POPPLER_PATH) -> int:
+    """Returns the number of pages in a PDF without rasterizing it."""
+    return int(pdfinfo_from_path(pdf_path, poppler_path=poppler_path)["Pages"])
+
+def iter_ocr_pages(pdf_path: str, lang: str = "eng", workers: int | None = None,
+                   poppler_path: str | None = POPPLER_PATH, window: int = 1, use_text_layer: bool = True,
+                   adaptive: bool | None = None, dpi: int | None = None, retry_dpi: int | None = None,
+                   min_confidence: float | None = None, page_count: int | None = None):
+    """
+    Yields (page_number, text, source, info) in page order, where source is "text" for pages
+    read from the PDF's embedded text layer and "ocr" for pages that went through Tesseract,
+    and info is {"dpi", "confidence", "retried"} for OCR'd pages (empty for text-layer pages).
+
+    Pages without a usable text layer are rasterized only `window` at a time with
+    pdf2image's first_page/last_page, OCR'd and released before the next window, so
+    peak memory depends on the window and worker count, not on the length of the document.
+    In adaptive mode (default ADAPTIVE_OCR) pages start at the lower ADAPTIVE_DPI and only
+    those below min_confidence are OCR'd again at retry_dpi; see _ocr_page_window.
+    page_count is read from the PDF unless the caller already knows it.
+    """
+    if page_count is None:
+        page_count = count_pages(pdf_path, poppler_path=poppler_path)
+    window = max(1, window)
+    if adaptive is None:
+        adaptive = ADAPTIVE_OCR
+    if dpi is None:
+        dpi = ADAPTIVE_DPI if adaptive else OCR_DPI
+    # Passed to the workers explicitly so overrides reach processes that re-import this module
+    adaptive_settings = (retry_dpi or ADAPTIVE_RETRY_DPI,
+                         MIN_CONFIDENCE if min_confidence is None else min_confidence) if adaptive else None
+
+    with metrics.timed('ocr.text_layer'):
+        layer = extract_text_layer(pdf_path, poppler_path=poppler_path) if use_text_layer else []
+    if len(layer) != page_count:
+        layer = []
+    native = {i + 1: text for i, text in enumerate(layer) if has_text_layer(text)}
+
+    # Group the pages that still need OCR into runs of consecutive pages, at most `window` long
+    tasks = []
+    for page in range(1, page_count + 1):
+        if page in native:
+            continue
+        if tasks and tasks[-1][2] == page - 1 and page - tasks[-1][1] < window:
+            tasks[-1] = (pdf_path, tasks[-1][1], page, lang, poppler_path, dpi, adaptive_settings)
+        else:
+            tasks.append((pdf_path, page, page, lang, poppler_path, dpi, adaptive_settings))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(tasks)))
+
+    if workers == 1:
+        ocr_results = map(_ocr_page_window, tasks)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker,
+                                   mp_context=OCR_POOL_CONTEXT)
+        ocr_results = pool.map(_ocr_page_window, tasks)
+
+    try:
+        page = 1
+        for task, (texts, render_seconds, tesseract_seconds, infos) in zip(tasks, ocr_results):
+            metrics.add_time('ocr.render', render_seconds)
+            metrics.add_time('ocr.tesseract', tesseract_seconds)
+            metrics.count('pages_ocr_retried', sum(info["retried"] for info in infos))
+            first = task[1]
+            while page < first:
+                yield page, native[page], "text", {}
+                page += 1
+            for text, info in zip(texts, infos):
+                yield page, text, "ocr", info
+                page += 1
+        while page <= page_count:
+            yield page, native[page], "text", {}
+            page += 1
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+def ocr_pdf_to_text(pdf_path: str, lang: str = "eng", workers: int | None = None,
+                    poppler_path: str | None = POPPLER_PATH, stream: bool = True, window: int = 1,
+                    use_text_layer: bool = True, page_sources: list | None = None, progress=None,
+                    adaptive: bool | None = None, dpi: int | None = None, retry_dpi: int | None = None,
+                    min_confidence: float | None = None) -> str:
     """
     Converts a PDF to images, performs OCR, and returns the full text.
 
+    Pages are OCR'd in parallel across a process pool; the output keeps page order.
+
     Args:
         pdf_path (str): Path to the input PDF file.
         lang (str): OCR language code (default is 'eng').
+        workers (int): Number of OCR processes (default is the number of CPUs, 1 disables the pool).
+        poppler_path (str): Poppler binary directory (None lets pdf2image find it on PATH).
+        stream (bool): Rasterize `window` pages at a time instead of the whole document up front
+                       (the text-layer fast path and adaptive mode are only available when streaming).
+        window (int): Pages rendered per step when streaming (default is 1).
+        use_text_layer (bool): Read pages that carry an embedded text layer directly and OCR only the rest.
+        page_sources (list): If given, receives one {"page": n, "source": "text" | "ocr"} entry per page,
+                             plus "dpi", "confidence" and "retried" for OCR'd pages.
+        progress (callable): If given, called as progress(pages_done, page_count) after each page.
+        adaptive (bool): OCR binarized pages at a lower resolution and redo only low-confidence pages
+                         at retry_dpi (default is ADAPTIVE_OCR, set with OCR_ADAPTIVE=1).
+        dpi (int): Render resolution (default is ADAPTIVE_DPI in adaptive mode, OCR_DPI otherwise).
+        retry_dpi (int): Resolution low-confidence pages are OCR'd again at (default is ADAPTIVE_RETRY_DPI).
+        min_confidence (float): Mean word confidence (0-100) below which a page is retried
+                                (default is MIN_CONFIDENCE).
 
     Returns:
         str: Combined OCR text from all PDF pages.
     """
-    images = convert_from_path(pdf_path, dpi=300, poppler_path=POPPLER_PATH)
-
     full_text = ""
-    for i, img in enumerate(images):
-        text = pytesseract.image_to_string(img, lang=lang)
+
+    if stream:
+        sources = {"text": 0, "ocr": 0}
+        # Read once here for progress and passed on, so pdfinfo runs once per document
+        page_count = count_pages(pdf_path, poppler_path=poppler_path)
+        for page_number, text, source, info in iter_ocr_pages(pdf_path, lang=lang, workers=workers,
+                                                              poppler_path=poppler_path, window=window,
+                                                              use_text_layer=use_text_layer, adaptive=adaptive,
+                                                              dpi=dpi, retry_dpi=retry_dpi,
+                                                              min_confidence=min_confidence,
+                                                              page_count=page_count):
+            full_text += f"\n=== Page {page_number} ===\n{text}\n"
+            sources[source] += 1
+            if page_sources is not None:
+                page_sources.append({"page": page_number, "source": source, **info})
+            if progress:
+                progress(page_number, page_count)
+        print(f"Pages read from text layer: {sources['text']}, pages OCR'd: {sources['ocr']}")
+        metrics.count('pages', sources['text'] + sources['ocr'])
+        metrics.count('pages_text_layer', sources['text'])
+        metrics.count('pages_ocr', sources['ocr'])
+        return full_text
+
+    with metrics.timed('ocr.render'):
+        images = convert_from_path(pdf_path, dpi=dpi or OCR_DPI, poppler_path=poppler_path)
+    metrics.count('pages', len(images))
+    metrics.count('pages_ocr', len(images))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(images)))
+
+    with metrics.timed('ocr.tesseract'):
+        if workers == 1:
+            texts = [pytesseract.image_to_string(img, lang=lang) for img in images]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker,
+                                     mp_context=OCR_POOL_CONTEXT) as pool:
+                texts = list(pool.map(_ocr_image, [(img, lang) for img in images]))
+
+    for i, text in enumerate(texts):
         full_text += f"\n=== Page {i + 1} ===\n{text}\n"
 
     return full_text
@@ -30,3 +318,8 @@ def ocr_pdf_to_text(pdf_path: str, lang: str = "eng") -> str:
 # Example usage:
 # text = ocr_pdf_to_text("Brac 1.pdf")
 # print(text)
+# text = ocr_pdf_to_text("Brac 1.pdf", workers=4)
+# text = ocr_pdf_to_text("Brac 1.pdf", workers=1, window=2)  # two pages in memory at a time
+# sources = []
+# text = ocr_pdf_to_text("Brac 1.pdf", page_sources=sources)  # [{"page": 1, "source": "text"}, ...]
+# text = ocr_pdf_to_text("Brac 1.pdf", adaptive=True, dpi=150, min_confidence=80)  # 150 DPI, 300 for unclear pages
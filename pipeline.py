@@ -0,0 +1,142 @@
+import os
+
+import cache
+import extraction
+import metrics
+import ocr_2
+import post_processing
+from ocr_2 import ocr_pdf_to_text
+
+# Bump these when a stage's output changes for the same input, so cached results are recomputed.
+# Each later stage includes the versions it depends on; the extraction stage adds the backend's own version.
+OCR_VERSION = "ocr-1"
+ROWS_VERSION = "rows-1"
+
+def ocr_version():
+    """OCR_VERSION plus the effective OCR settings, so switching e.g. to adaptive OCR doesn't reuse old text."""
+    return f"{OCR_VERSION}|{ocr_2.settings_version()}"
+
+def run_pipeline(file_path, output_file, use_cache=True, backend=None, bank=None, progress=None, on_row=None):
+    """
+    Runs OCR, transaction extraction and post-processing for one uploaded statement.
+
+    Every stage result is cached on disk under the SHA-256 of the file's bytes, so a
+    re-upload of the same statement skips whichever stages have already been computed.
+    Extracted lines are cleaned and validated as the backend streams them, so on_row
+    sees the first rows while the model is still generating the rest.
+
+    Args:
+        file_path (str): Path to the uploaded PDF.
+        output_file (str): Path of the validated CSV to write.
+        use_cache (bool): Read and write the result cache (default is True).
+        backend (str): Extraction backend name (see extraction.get_backend).
+        bank (str): Bank template used to pick the backend when none is given.
+        progress (callable): If given, called as progress(stage, **counters) with
+            pages_done/pages_total during OCR, chunks_done/chunks_total during extraction
+            and rows_validated during validation.
+        on_row (callable): If given, called with each validated row dict as soon as it exists.
+
+    Returns:
+        tuple: (list of validated row dicts, path to the output CSV file)
+    """
+    rows = []
+    for row in stream_pipeline(file_path, output_file, use_cache, backend, bank, progress):
+        rows.append(row)
+        if on_row:
+            on_row(row)
+    return rows, output_file
+
+def stream_pipeline(file_path, output_file, use_cache=True, backend=None, bank=None, progress=None, text=None):
+    """
+    Generator version of run_pipeline: yields each validated row as soon as it exists.
+
+    Lines flow from the extraction backend through cleaning, validation and the CSV
+    writer one at a time. Rows are only collected in memory when use_cache is on, for
+    the 'rows' cache entry written once the statement is complete.
+
+    Args:
+        Same as run_pipeline, without on_row, plus:
+        text (str): OCR text of file_path when it has already been computed elsewhere
+            (e.g. by the batch runner's OCR processes); skips the OCR stage.
+
+    Yields:
+        dict: Each validated row, after it has been written to output_file
+    """
+    if progress is None:
+        def progress(stage, **counters):
+            pass
+
+    extractor = extraction.get_backend(backend, bank)
+    extraction_version = f"{ocr_version()}|{extractor.name}|{extractor.version}"
+    rows_version = f"{extraction_version}|{ROWS_VERSION}"
+    if post_processing.EXACT_MONEY:
+        # Fixed-point validation words FALSE statuses differently, so its rows are cached separately
+        rows_version += "|exact"
+
+    with metrics.timed('cache'):
+        content_hash = cache.hash_file(file_path) if use_cache else None
+        rows = cache.get(content_hash, 'rows', rows_version) if use_cache else None
+    if rows is not None:
+        print("Cache hit: validated rows")
+        metrics.count('cache_hits')
+        yield from post_processing.stream_validated_csv(rows, output_file)
+        metrics.count('rows', len(rows))
+        progress('validation', rows_validated=len(rows))
+        return
+
+    with metrics.timed('cache'):
+        transactions = cache.get(content_hash, 'extraction', extraction_version) if use_cache else None
+    if transactions is None:
+        if text is None:
+            with metrics.timed('cache'):
+                text = cache.get(content_hash, 'ocr', ocr_version()) if use_cache else None
+            if text is not None:
+                print("Cache hit: OCR text")
+                metrics.count('cache_hits')
+        if text is None:
+            # Perform OCR
+            with metrics.timed('ocr'):
+                text = ocr_pdf_to_text(file_path, progress=lambda done, total: progress(
+                    'ocr', pages_done=done, pages_total=total))
+            if use_cache:
+                with metrics.timed('cache'):
+                    cache.put(content_hash, 'ocr', ocr_version(), text)
+        # Extract transaction lines with the selected backend, one line at a time
+        progress('extraction')
+        lines = extractor.stream(text, progress=lambda done, total: progress(
+            'extraction', chunks_done=done, chunks_total=total))
+    else:
+        print("Cache hit: extracted transactions")
+        metrics.count('cache_hits')
+        lines = transactions.splitlines()
+    # Time spent waiting for the backend's lines, as opposed to cleaning and validating them
+    lines = metrics.IterTimer(lines)
+
+    extracted = []
+
+    def transaction_lines():
+        for line in lines:
+            if use_cache:
+                extracted.append(line)
+            yield from post_processing.clean_bank_lines(line)
+
+    # Clean, validate and write each line as soon as it is extracted
+    records = post_processing.validate_bank_lines(post_processing.clean_bank_statement(transaction_lines()))
+    chain = metrics.IterTimer(post_processing.stream_validated_csv(records, output_file))
+    rows = []
+    count = 0
+    for count, row in enumerate(chain, 1):
+        if use_cache:
+            rows.append(row)
+        yield row
+        progress('validation', rows_validated=count)
+    metrics.add_time('extraction', lines.seconds)
+    metrics.add_time('post_processing', chain.seconds - lines.seconds)
+    metrics.count('rows', count)
+
+    print(f"Processing and validation complete. Output saved to: {os.path.abspath(output_file)}")
+    if use_cache:
+        with metrics.timed('cache'):
+            if transactions is None:
+                cache.put(content_hash, 'extraction', extraction_version, "\n".join(extracted))
+            cache.put(content_hash, 'rows', rows_version, rows)
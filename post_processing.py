@@ -1,6 +1,28 @@
 import re
 import csv
 import os
+from array import array
+
+import numpy as np
+
+# Column order of the validated statement CSV
+OUTPUT_HEADERS = ['Date', 'Description', 'Type', 'Label', 'Amount', 'Balance', 'Status']
+
+# Transaction line patterns: date at the start, balance as the last number, amount as the number before it
+DATE_PATTERN = re.compile(r'(\d{2}-[A-Za-z]{3}-\d{4})')
+BALANCE_PATTERN = re.compile(r'(-?[\d,]+(?:\s+[\d,]+)*(?:\.\d+)?)$')
+AMOUNT_PATTERN = re.compile(r'(-?[\d,]+\.\d+)(?:\s*)$')
+DESCRIPTION_JUNK_PATTERN = re.compile(r'[^a-zA-Z\s]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Two balances that round to the same cents are at most 0.01 apart; validate_statements only
+# calls round() for rows this close, and every other row is known to differ without it
+ROUND_CHECK_TOLERANCE = 0.02
+
+# Fixed-point mode: money is kept as integer minor units (paisa) and balances are checked exactly,
+# so long statements with large balances don't collect float rounding errors. Off by default
+# because the "Expected" value in FALSE statuses is then written with two decimals.
+EXACT_MONEY = os.environ.get("EXACT_MONEY", "0") == "1"
 
 # def clean_bank_lines(text):
 #     cleaned_lines = []
@@ -14,25 +36,24 @@ import os
 
 #     return cleaned_lines
 
-# def clean_bank_lines(text):
-#     cleaned_lines = []
-#     date_pattern = re.compile(r'^\d{2}-[A-Za-z]{3}-\d{4}')
+def clean_bank_lines(text):
+    cleaned_lines = []
+    date_pattern = re.compile(r'^\d{2}-[A-Za-z]{3}-\d{4}')
 
-#     for line in text.strip().splitlines():
-#         # Remove leading special characters like =, :, ; etc.
-#         cleaned_line = re.sub(r'^[^0-9A-Za-z]+', '', line).strip()
+    for line in text.strip().splitlines():
+        # Remove leading special characters like =, :, ; etc.
+        cleaned_line = re.sub(r'^[^0-9A-Za-z]+', '', line).strip()
 
-#         # Only keep lines that start with a valid date pattern
-#         if date_pattern.match(cleaned_line):
-#             cleaned_lines.append(cleaned_line)
+        # Only keep lines that start with a valid date pattern
+        if date_pattern.match(cleaned_line):
+            cleaned_lines.append(cleaned_line)
 
-#     return cleaned_lines
+    return cleaned_lines
 
 
 
 def clean_bank_statement(lines):
-    cleaned_data = []
-
+    """Yields each line with OCR number-formatting errors fixed, one line at a time."""
     for line in lines:
         # Remove leading characters that aren't part of the date
         parts = line.split()
@@ -56,148 +77,408 @@ def clean_bank_statement(lines):
                     words[-1] = decimal_parts[0] + '.' + new_decimal
                     line = ' '.join(words)
 
-        cleaned_data.append(line)
+        yield line
 
-    return cleaned_data
-
-def process_and_validate_bank_statement(result, output_file="validated_bank_statement.csv"):
+def to_minor_units(value):
     """
-    Process raw bank statement data, extract transaction details, and validate the transactions
-    by checking if the balance after each transaction matches the expected balance.
+    Converts a cleaned decimal string ("-1449.00", "82104.5") to integer minor units.
+
+    Digits past the second decimal place are rounded half away from zero.
 
     Args:
-        result (list): List of raw bank statement lines
-        output_file (str): Path to the output CSV file
+        value (str): Number without commas or spaces, as in the 'Amount' and 'Balance' fields
 
     Returns:
-        str: Path to the output CSV file
+        int: The value in minor units (e.g. -144900)
     """
-    # Define the output headers in the specified order
-    output_headers = ['Date', 'Description', 'Type', 'Label', 'Amount', 'Balance', 'Status']
-
-    # First pass: Extract transaction details from raw data
-    transactions = []
-    previous_balance = None
-
-    for i, line in enumerate(result):
-        # Extract date (assuming it's always at the beginning and in DD-MMM-YYYY format)
-        date_match = re.match(r'(\d{2}-[A-Za-z]{3}-\d{4})', line)
-        date = date_match.group(1) if date_match else ""
-
-        # Remove the date from the line
-        remaining = line[len(date):].strip() if date else line
-
-        # First, extract the balance which is always the last number pattern in the line
-        # Modified regex to handle both complete numbers with decimals and incomplete numbers
-        balance_match = re.search(r'(-?[\d,]+(?:\s+[\d,]+)*(?:\.\d+)?)$', remaining)
-        balance = balance_match.group(1) if balance_match else ""
-
-        # Remove the balance from the remaining text
-        if balance:
-            # Use the exact balance string to remove it from the remaining text
-            remaining = remaining[:remaining.rfind(balance)].strip()
-
-        # Now extract the amount which should be the last number pattern in the remaining text
-        # Modified regex to handle both complete numbers with decimals
-        amount_match = re.search(r'(-?[\d,]+\.\d+)(?:\s*)$', remaining)
-        amount = amount_match.group(1) if amount_match else ""
-
-        # Remove the amount from the remaining text
-        if amount:
-            # Use the exact amount string to remove it from the remaining text
-            remaining = remaining[:remaining.rfind(amount)].strip()
-
-        # Clean up the description - remove numbers and special characters
-        description = re.sub(r'[^a-zA-Z\s]', '', remaining).strip()
-        # Remove extra spaces
-        description = re.sub(r'\s+', ' ', description)
-
-        # Fix the balance format by removing internal spaces and commas
-        balance_for_calc = balance.replace(" ", "").replace(",", "")
+    negative = value.startswith('-')
+    whole, _, fraction = value.lstrip('-').partition('.')
+    if not (whole + fraction).isdigit():
+        raise ValueError(f"Not a decimal number: {value!r}")
+
+    minor = int(whole or 0) * 100 + int((fraction + "00")[:2])
+    if fraction[2:3] >= "5":
+        minor += 1
+    return -minor if negative else minor
+
+def format_minor_units(minor):
+    """Formats integer minor units as a decimal string with two decimals, e.g. -144900 -> "-1449.00"."""
+    sign = "-" if minor < 0 else ""
+    return f"{sign}{abs(minor) // 100}.{abs(minor) % 100:02d}"
+
+def parse_transaction_line(line):
+    """
+    Extracts the date, description, amount and balance from one cleaned statement line.
 
-        # Add decimal zeros if missing (e.g., "-1,449" becomes "-1449.00")
-        if balance_for_calc and '.' not in balance_for_calc:
-            balance_for_calc = balance_for_calc + ".00"
+    Args:
+        line (str): One cleaned transaction line
 
-        # Remove commas from amount
-        amount_for_output = amount.replace(",", "")
+    Returns:
+        dict: 'Date', 'Description', 'Amount' and 'Balance' as written to the CSV, plus
+              'amount_value' and 'balance_value' as floats for the balance checks
+    """
+    # Extract date (assuming it's always at the beginning and in DD-MMM-YYYY format)
+    date_match = DATE_PATTERN.match(line)
+    date = date_match.group(1) if date_match else ""
+
+    # Remove the date from the line
+    remaining = line[len(date):].strip() if date else line
+
+    # First, extract the balance which is always the last number pattern in the line
+    # Modified regex to handle both complete numbers with decimals and incomplete numbers
+    balance_match = BALANCE_PATTERN.search(remaining)
+    balance = balance_match.group(1) if balance_match else ""
+
+    # Remove the balance from the remaining text
+    if balance:
+        # Use the exact balance string to remove it from the remaining text
+        remaining = remaining[:remaining.rfind(balance)].strip()
+
+    # Now extract the amount which should be the last number pattern in the remaining text
+    # Modified regex to handle both complete numbers with decimals
+    amount_match = AMOUNT_PATTERN.search(remaining)
+    amount = amount_match.group(1) if amount_match else ""
+
+    # Remove the amount from the remaining text
+    if amount:
+        # Use the exact amount string to remove it from the remaining text
+        remaining = remaining[:remaining.rfind(amount)].strip()
+
+    # Clean up the description - remove numbers and special characters
+    description = DESCRIPTION_JUNK_PATTERN.sub('', remaining).strip()
+    # Remove extra spaces
+    description = WHITESPACE_PATTERN.sub(' ', description)
+
+    # Fix the balance format by removing internal spaces and commas
+    balance_for_calc = balance.replace(" ", "").replace(",", "")
+
+    # Add decimal zeros if missing (e.g., "-1,449" becomes "-1449.00")
+    if balance_for_calc and '.' not in balance_for_calc:
+        balance_for_calc = balance_for_calc + ".00"
+
+    # Remove commas from amount
+    amount_for_output = amount.replace(",", "")
+
+    # Convert amount and balance to float for comparison
+    amount_value = float(amount.replace(',', '')) if amount else 0
+
+    try:
+        balance_value = float(balance_for_calc) if balance_for_calc else 0
+    except ValueError:
+        print(f"Warning: Could not convert balance '{balance_for_calc}' to float. Using 0.")
+        balance_value = 0
+
+    return {
+        'Date': date,
+        'Description': description,
+        'Amount': amount_for_output,
+        'Balance': balance_for_calc,
+        'amount_value': amount_value,
+        'balance_value': balance_value
+    }
+
+class StatementValidator:
+    """
+    Labels transactions as debit or credit and checks the running balance, one line at a time.
 
-        # Convert amount and balance to float for comparison
-        amount_value = float(amount.replace(',', '')) if amount else 0
+    Lines must be added in statement order; each call to add() only needs the previous
+    line's balance, so rows can be validated as soon as they are extracted.
+    """
 
-        try:
-            balance_value = float(balance_for_calc) if balance_for_calc else 0
-        except ValueError:
-            print(f"Warning: Could not convert balance '{balance_for_calc}' to float. Using 0.")
-            balance_value = 0
+    def __init__(self, exact=None):
+        """
+        Args:
+            exact (bool): Compare balances as integer minor units instead of rounded floats
+                (default is EXACT_MONEY)
+        """
+        self.exact = EXACT_MONEY if exact is None else exact
+        self.previous_balance = None
+        self.current_balance = 0 if self.exact else 0.00
+
+    def add(self, line):
+        """
+        Parses and validates the next statement line.
+
+        Args:
+            line (str): One cleaned transaction line
+
+        Returns:
+            dict: The CSV record, keyed by OUTPUT_HEADERS
+        """
+        parsed = parse_transaction_line(line)
+        if self.exact:
+            balance_value = to_minor_units(parsed['Balance']) if parsed['Balance'] else 0
+        else:
+            balance_value = parsed['balance_value']
 
         # Determine if it's a debit or credit transaction
-        if i == 0 or previous_balance is None:
+        if self.previous_balance is None:
             # First transaction is typically a debit (loan disbursement)
             transaction_type = '##'  # Debit
             label = 'Debit'
         else:
             # Compare current balance with previous balance
-            if balance_value < previous_balance:
+            if balance_value < self.previous_balance:
                 transaction_type = '##'  # Debit (balance decreased)
                 label = 'Debit'
             else:
                 transaction_type = '*'   # Credit (balance increased)
                 label = 'Credit'
 
+        # Update previous_balance for next comparison
+        self.previous_balance = balance_value
+
         # Create transaction record
-        transaction = {
-            'Date': date,
-            'Description': description,
+        record = {
+            'Date': parsed['Date'],
+            'Description': parsed['Description'],
             'Type': transaction_type,
             'Label': label,
-            'Amount': amount_for_output,
-            'Balance': balance_for_calc
+            'Amount': parsed['Amount'],
+            'Balance': parsed['Balance']
         }
 
-        transactions.append(transaction)
-
-        # Update previous_balance for next comparison
-        previous_balance = balance_value
-
-    # Second pass: Validate transactions
-    current_balance = 0.00
-    validated_transactions = []
-
-    for record in transactions:
         # Convert string values to appropriate types
-        amount = float(record["Amount"]) if record["Amount"] else 0.00
-        balance = float(record["Balance"]) if record["Balance"] else 0.00
-        txn_type = record["Type"]
+        if self.exact:
+            amount = to_minor_units(record["Amount"]) if record["Amount"] else 0
+            balance = balance_value
+        else:
+            amount = float(record["Amount"]) if record["Amount"] else 0.00
+            balance = float(record["Balance"]) if record["Balance"] else 0.00
 
         # Calculate expected balance
-        expected_balance = current_balance
+        expected_balance = self.current_balance
 
-        if txn_type == "##":  # Debit
+        if transaction_type == "##":  # Debit
             expected_balance -= amount
-        elif txn_type == "*":  # Credit
+        elif transaction_type == "*":  # Credit
             expected_balance += amount
         else:
             record["Status"] = "❓ Unknown Type"
-            validated_transactions.append(record)
-            continue
+            return record
 
+        if self.exact:
+            if expected_balance == balance:
+                record["Status"] = "✅ OK"
+            else:
+                record["Status"] = f"❌ FALSE (Expected: {format_minor_units(expected_balance)})"
         # Compare expected vs actual balance (rounding to avoid float precision issues)
-        if round(expected_balance, 2) == round(balance, 2):
+        elif round(expected_balance, 2) == round(balance, 2):
             record["Status"] = "✅ OK"
         else:
             record["Status"] = f"❌ FALSE (Expected: {round(expected_balance, 2)})"
 
         # Update the balance for the next iteration using the *actual* balance
-        current_balance = balance
+        self.current_balance = balance
+
+        return record
+
+def validate_bank_lines(lines, exact=None):
+    """
+    Validates cleaned transaction lines one at a time.
+
+    Args:
+        lines (iterable): Cleaned transaction lines in statement order, e.g. a generator
+        exact (bool): Check balances as integer minor units (default is EXACT_MONEY)
+
+    Yields:
+        dict: Each validated record, keyed by OUTPUT_HEADERS, as soon as its line arrives
+    """
+    validator = StatementValidator(exact)
+    for line in lines:
+        yield validator.add(line)
+
+class StatementBatch:
+    """
+    Parsed and validated transactions of many statements, stored column by column.
+
+    Rows of each statement are contiguous and in statement order; statement_index[i] is
+    the statement row i belongs to. Text columns are lists of str, the others NumPy arrays.
+    With exact=True the money columns are int64 minor units instead of float64.
+    """
+
+    def __init__(self, statement_index, dates, descriptions, amounts, balances,
+                 amount_values, balance_values, is_debit, expected_balances, ok, exact=False):
+        self.exact = exact
+        self.statement_index = statement_index
+        self.dates = dates
+        self.descriptions = descriptions
+        self.amounts = amounts
+        self.balances = balances
+        self.amount_values = amount_values
+        self.balance_values = balance_values
+        self.is_debit = is_debit
+        self.expected_balances = expected_balances
+        self.ok = ok
+
+    def __len__(self):
+        return len(self.dates)
+
+    def rows(self, statement):
+        """Returns the slice of rows that belong to the given statement."""
+        start, stop = np.searchsorted(self.statement_index, [statement, statement + 1])
+        return slice(int(start), int(stop))
+
+    def records(self, statement=None):
+        """
+        Builds the CSV records, the same dicts StatementValidator.add returns.
+
+        Args:
+            statement (int): Only return this statement's rows (default is every row)
+
+        Returns:
+            list: Records keyed by OUTPUT_HEADERS
+        """
+        rows = self.rows(statement) if statement is not None else slice(0, len(self))
+        # tolist() gives Python floats, so round() and the status text behave exactly like the validator
+        expected = self.expected_balances[rows].tolist()
+        records = []
+        for i, is_debit, ok, expected_balance in zip(range(rows.start, rows.stop), self.is_debit[rows].tolist(),
+                                                     self.ok[rows].tolist(), expected):
+            records.append({
+                'Date': self.dates[i],
+                'Description': self.descriptions[i],
+                'Type': '##' if is_debit else '*',
+                'Label': 'Debit' if is_debit else 'Credit',
+                'Amount': self.amounts[i],
+                'Balance': self.balances[i],
+                'Status': "✅ OK" if ok else f"❌ FALSE (Expected: {self._format_expected(expected_balance)})"
+            })
+        return records
+
+    def _format_expected(self, expected_balance):
+        if self.exact:
+            return format_minor_units(expected_balance)
+        return round(expected_balance, 2)
+
+def _fits_int64(value):
+    return -2 ** 63 <= value < 2 ** 63
+
+def _column(values, dtype):
+    # Typed arrays are wrapped without copying; lists only hold Python ints that overflowed int64
+    if isinstance(values, list):
+        return np.array(values, dtype=dtype)
+    return np.frombuffer(values, dtype=dtype) if values else np.zeros(0, dtype=dtype)
+
+def validate_statements(statements, exact=None):
+    """
+    Parses and validates many statements at once, for bulk reprocessing.
+
+    Lines are parsed into columns, then debit/credit labels and running-balance checks
+    are computed with array operations over all statements together. The results match
+    StatementValidator row for row.
+
+    Args:
+        statements (list): One list of cleaned transaction lines per statement
+        exact (bool): Keep money as int64 minor units and check balances exactly
+            (default is EXACT_MONEY)
+
+    Returns:
+        StatementBatch: The parsed and validated rows of every statement
+    """
+    exact = EXACT_MONEY if exact is None else exact
+    # Same conversions as StatementValidator.add, into compact typed arrays rather than lists of objects
+    convert = to_minor_units if exact else float
+    typecode, dtype = ('q', np.int64) if exact else ('d', np.float64)
+
+    counts = array('q')
+    dates, descriptions, amounts, balances = [], [], [], []
+    amount_values, balance_values = array(typecode), array(typecode)
+    for lines in statements:
+        counts.append(len(lines))
+        for line in lines:
+            parsed = parse_transaction_line(line)
+            dates.append(parsed['Date'])
+            descriptions.append(parsed['Description'])
+            amounts.append(parsed['Amount'])
+            balances.append(parsed['Balance'])
+            amount_value = convert(parsed['Amount']) if parsed['Amount'] else 0
+            balance_value = convert(parsed['Balance']) if parsed['Balance'] else 0
+            if exact and dtype is not object and not (_fits_int64(amount_value) and _fits_int64(balance_value)):
+                # OCR can run two numbers together into one beyond int64; keep exact Python ints instead
+                amount_values, balance_values, dtype = list(amount_values), list(balance_values), object
+            amount_values.append(amount_value)
+            balance_values.append(balance_value)
+
+    counts = _column(counts, np.int64)
+    statement_index = np.repeat(np.arange(len(counts)), counts)
+    amount = _column(amount_values, dtype)
+    balance = _column(balance_values, dtype)
+
+    # The first row of every statement is a debit checked against a zero opening balance
+    first = np.zeros(len(balance), dtype=bool)
+    first[(np.cumsum(counts) - counts)[counts > 0]] = True
+    previous = np.zeros(len(balance), dtype=dtype)
+    previous[1:] = balance[:-1]
+    previous[first] = 0
+
+    is_debit = first | (balance < previous)
+    expected = np.where(is_debit, previous - amount, previous + amount)
+
+    ok = expected == balance
+    if not exact:
+        # Equal values are OK and values far apart are not; only rows in between need round()
+        close = ~ok & (np.abs(expected - balance) <= ROUND_CHECK_TOLERANCE)
+        for i, expected_balance, actual in zip(np.flatnonzero(close).tolist(), expected[close].tolist(),
+                                               balance[close].tolist()):
+            ok[i] = round(expected_balance, 2) == round(actual, 2)
+
+    return StatementBatch(statement_index, dates, descriptions, amounts, balances,
+                          amount, balance, is_debit, expected, ok, exact)
+
+def write_validated_csv(records, output_file):
+    """Writes validated records to a CSV file with the OUTPUT_HEADERS columns."""
+    for _ in stream_validated_csv(records, output_file):
+        pass
+
+def stream_validated_csv(records, output_file):
+    """
+    Writes records to a CSV file as they arrive and passes each one on.
 
-        validated_transactions.append(record)
+    Args:
+        records (iterable): Validated records, e.g. from validate_bank_lines
+        output_file (str): Path to the output CSV file
 
-    # Write the validated data to the output CSV file
+    Yields:
+        dict: Each record, after it has been written
+    """
     with open(output_file, 'w', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=output_headers)
+        writer = csv.DictWriter(csvfile, fieldnames=OUTPUT_HEADERS)
         writer.writeheader()
-        writer.writerows(validated_transactions)
+        for record in records:
+            writer.writerow(record)
+            yield record
+
+def process_and_validate_bank_statement(result, output_file="validated_bank_statement.csv", export_formats=(),
+                                        transaction_store=None, username=None, account=""):
+    """
+    Process raw bank statement data, extract transaction details, and validate the transactions
+    by checking if the balance after each transaction matches the expected balance.
+
+    Args:
+        result (list): List of raw bank statement lines
+        output_file (str): Path to the output CSV file
+        export_formats (tuple): Typed exports ('parquet', 'arrow', 'jsonl') to write next to the
+            CSV in the same pass (see export.py)
+        transaction_store (transactions.TransactionStore): If given, the rows are also stored there
+            under username and account, in bulk transactions
+        username (str): Owner of the statement, for transaction_store
+        account (str): Account number of the statement, for transaction_store
+
+    Returns:
+        str: Path to the output CSV file
+    """
+    # Validate and write one row at a time, without holding the whole statement in memory
+    records = stream_validated_csv(validate_bank_lines(result), output_file)
+    if export_formats:
+        import export
+        for fmt in export_formats:
+            fmt = export.resolve_format(fmt)
+            records = export.stream_export(records, export.export_path(output_file, fmt), fmt)
+    if transaction_store is not None:
+        records = transaction_store.stream_insert(records, username, account, source=output_file)
+    for _ in records:
+        pass
 
     print(f"Processing and validation complete. Output saved to: {os.path.abspath(output_file)}")
     return output_file
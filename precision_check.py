@@ -0,0 +1,110 @@
+"""
+Compares the transaction lines extracted at reduced precision against the float32 output.
+
+Usage:
+    python precision_check.py "Brac 1.pdf" statement2.pdf --precisions bfloat16 int8
+
+PDFs are OCR'd once; .txt files are read as OCR text. Every precision, float32 included,
+runs in its own subprocess so load time, tokens/sec and peak memory are measured per precision.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import metrics
+from benchmarks.inputs import load_texts
+
+def run_precision(precision, texts_file, result_file):
+    """Child process: loads the model at one precision and extracts every statement."""
+    import model
+
+    with open(texts_file, 'r', encoding='utf-8') as f:
+        texts = json.load(f)
+
+    start = time.time()
+    model.load_model(precision)
+    load_seconds = time.time() - start
+
+    outputs = []
+    new_tokens = 0
+    start = time.time()
+    for text in texts:
+        output = model.extract_transactions(text)
+        outputs.append(output)
+        new_tokens += len(model.tokenizer(output, add_special_tokens=False)["input_ids"])
+    generate_seconds = time.time() - start
+
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'precision': precision,
+            'outputs': outputs,
+            'load_seconds': round(load_seconds, 1),
+            'generate_seconds': round(generate_seconds, 1),
+            'tokens_per_second': round(new_tokens / generate_seconds, 2) if generate_seconds else None,
+            # Lifetime peak of this child process, which only ever loaded this precision
+            'peak_rss_mb': metrics.peak_rss_mb(),
+        }, f)
+
+def compare_lines(reference, candidate):
+    """Line-level precision/recall of candidate output against the reference output."""
+    def lines(output):
+        return [" ".join(line.split()) for line in output.splitlines() if line.strip()]
+
+    ref, cand = lines(reference), lines(candidate)
+    remaining = list(ref)
+    matched = 0
+    for line in cand:
+        if line in remaining:
+            remaining.remove(line)
+            matched += 1
+    return matched, len(ref), len(cand)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check extraction accuracy of reduced-precision models against float32.")
+    parser.add_argument('inputs', nargs='*', help="Statement PDFs or OCR text files")
+    parser.add_argument('--precisions', nargs='+', default=['bfloat16', 'int8'], help="Precisions to compare")
+    parser.add_argument('--run', nargs=3, metavar=('PRECISION', 'TEXTS', 'RESULT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_precision(*args.run)
+        return
+    if not args.inputs:
+        parser.error("at least one input file is required")
+
+    texts = [text for _, text in load_texts(args.inputs)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        texts_file = os.path.join(tmp, 'texts.json')
+        with open(texts_file, 'w', encoding='utf-8') as f:
+            json.dump(texts, f)
+
+        results = {}
+        for precision in ['float32'] + [p for p in args.precisions if p != 'float32']:
+            print(f"Running {precision}...")
+            result_file = os.path.join(tmp, f'{precision}.json')
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--run', precision, texts_file, result_file],
+                           check=True)
+            with open(result_file, 'r', encoding='utf-8') as f:
+                results[precision] = json.load(f)
+
+    reference = results['float32']['outputs']
+    print(f"\n{'precision':<10} {'load s':>8} {'tok/s':>8} {'peak MB':>9} {'identical':>10} {'line P':>7} {'line R':>7}")
+    for precision, result in results.items():
+        matched = ref_total = cand_total = identical = 0
+        for ref_output, output in zip(reference, result['outputs']):
+            m, r, c = compare_lines(ref_output, output)
+            matched, ref_total, cand_total = matched + m, ref_total + r, cand_total + c
+            identical += ref_output.strip() == output.strip()
+        line_precision = matched / cand_total if cand_total else 1.0
+        line_recall = matched / ref_total if ref_total else 1.0
+        print(f"{precision:<10} {result['load_seconds']:>8} {result['tokens_per_second'] or '-':>8} "
+              f"{result['peak_rss_mb'] or '-':>9} {identical:>5}/{len(reference):<4} "
+              f"{line_precision:>7.3f} {line_recall:>7.3f}")
+
+if __name__ == '__main__':
+    main()
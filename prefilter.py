@@ -0,0 +1,133 @@
+import re
+
+# Line classes
+TRANSACTION = "transaction"
+NOISE = "noise"
+AMBIGUOUS = "ambiguous"
+
+PAGE_MARKER = re.compile(r'^=== Page \d+ ===$')
+
+# Leading symbols OCR puts in front of the date (=, ;, :, =! ...), as stripped by post_processing.clean_bank_lines
+LEADING_SYMBOLS = re.compile(r'^[^0-9A-Za-z]+')
+
+# post_processing.clean_bank_lines keeps only lines that start with this, so anything else can never become a row
+DATE_PREFIX = re.compile(r'^\d{2}-[A-Za-z]{3}-\d{4}')
+
+# Date with a real month, free text, then an amount and a balance with two decimals each
+TRANSACTION_LINE = re.compile(
+    r'^\d{2}-(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)-\d{4}\s'
+    r'.*?-?[\d,]*\d\.\d{2}\s+-?[\d,]*\d(?:[ ,]\d{3})*\.\d{2}$',
+    re.IGNORECASE
+)
+
+def estimate_tokens(text):
+    """Rough token count (words, numbers and punctuation), used when no tokenizer is at hand."""
+    return len(re.findall(r'\w+|[^\w\s]', text))
+
+def classify_line(line):
+    """
+    Classifies one OCR line as TRANSACTION, NOISE or AMBIGUOUS.
+
+    A line that doesn't start with a DD-MMM-YYYY date (after leading symbols) is noise:
+    post-processing would drop it whatever the model said. A dated line ending in an
+    amount and a balance is certainly a transaction. Anything else that starts with a
+    date (statement periods, lines with OCR-damaged numbers) is left to the model.
+    """
+    stripped = LEADING_SYMBOLS.sub('', line).strip()
+    if not DATE_PREFIX.match(stripped):
+        return NOISE
+    if TRANSACTION_LINE.match(stripped):
+        return TRANSACTION
+    return AMBIGUOUS
+
+def prefilter(text, count_tokens=estimate_tokens):
+    """
+    Splits OCR text into certain transaction lines and the ambiguous remainder for the LLM.
+
+    Args:
+        text (str): OCR text as returned by ocr_pdf_to_text.
+        count_tokens (callable): Token counter for the savings report (default is estimate_tokens).
+
+    Returns:
+        dict: 'lines' - list of (class, line) in original order, page markers excluded
+              'ambiguous_text' - ambiguous lines under their page markers, '' if there are none
+              'stats' - line counts per class and tokens before/after/saved
+    """
+    lines = []
+    ambiguous_text = ""
+    page_marker = None
+    counts = {TRANSACTION: 0, NOISE: 0, AMBIGUOUS: 0}
+
+    for line in text.splitlines():
+        if PAGE_MARKER.match(line.strip()):
+            page_marker = line.strip()
+            continue
+        if not line.strip():
+            continue
+        kind = classify_line(line)
+        counts[kind] += 1
+        lines.append((kind, line))
+        if kind == AMBIGUOUS:
+            if page_marker is not None:
+                ambiguous_text += f"\n{page_marker}\n"
+                page_marker = None
+            ambiguous_text += f"{line}\n"
+
+    tokens_before = count_tokens(text)
+    tokens_after = count_tokens(ambiguous_text) if ambiguous_text else 0
+    stats = {
+        'lines': len(lines),
+        'transaction_lines': counts[TRANSACTION],
+        'noise_lines': counts[NOISE],
+        'ambiguous_lines': counts[AMBIGUOUS],
+        'tokens_before': tokens_before,
+        'tokens_after': tokens_after,
+        'tokens_saved': tokens_before - tokens_after,
+    }
+    return {'lines': lines, 'ambiguous_text': ambiguous_text, 'stats': stats}
+
+def iter_merge_with_llm_lines(result, llm_lines):
+    """
+    Yields the transaction lines in statement order: the certain lines plus the ambiguous
+    lines the model kept, while the model's answer (llm_lines) may still be arriving.
+
+    The model copies lines in the order they appear, so once one of its lines matches
+    ambiguous line i (whitespace-normalized), everything before i is settled: certain lines
+    are yielded and ambiguous lines the model skipped are dropped. Certain lines up to the
+    next ambiguous one are yielded straight away. Model lines that match no remaining
+    ambiguous line are yielded where they arrive.
+    """
+    def normalize(line):
+        return " ".join(LEADING_SYMBOLS.sub('', line).split())
+
+    lines = result['lines']
+    position = 0
+
+    def settle(until):
+        # Yields certain lines in lines[position:until], or up to the next ambiguous line if until is None
+        nonlocal position
+        while position < len(lines) and (position < until if until is not None else lines[position][0] != AMBIGUOUS):
+            kind, line = lines[position]
+            if kind == TRANSACTION:
+                yield line.strip()
+            position += 1
+
+    yield from settle(None)
+    for llm_line in llm_lines:
+        if not llm_line.strip():
+            continue
+        key = normalize(llm_line)
+        match = next((i for i in range(position, len(lines))
+                      if lines[i][0] == AMBIGUOUS and normalize(lines[i][1]) == key), None)
+        if match is None:
+            yield llm_line.strip()
+            continue
+        yield from settle(match)
+        yield llm_line.strip()
+        position = match + 1
+        yield from settle(None)
+    yield from settle(len(lines))
+
+def merge_with_llm_output(result, llm_output=""):
+    """Non-streaming form of iter_merge_with_llm_lines, joining the lines into one text."""
+    return "\n".join(iter_merge_with_llm_lines(result, llm_output.splitlines()))
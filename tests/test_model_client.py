@@ -0,0 +1,73 @@
+"""
+model_client.stream_transactions must fail, rather than end normally, when the model server's
+stream stops before its closing metrics message.
+
+Run with: python -m unittest tests.test_model_client
+"""
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import model_client
+
+LINES = ["01-Apr-2023 Loan Disbursement 5.00 -5.00", "02-Apr-2023 Loan Recovery 1 2.00 -3.00"]
+
+class _Handler(BaseHTTPRequestHandler):
+    body = b''
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StreamTransactionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = model_client.MODEL_SERVER_URL
+        model_client.MODEL_SERVER_URL = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        model_client.MODEL_SERVER_URL = self.url
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stream(self, body):
+        _Handler.body = body
+        lines = []
+        try:
+            for line in model_client.stream_transactions("text"):
+                lines.append(line)
+        finally:
+            self.lines = lines
+        return lines
+
+    def test_complete_stream(self):
+        body = b''.join(json.dumps({'line': line}).encode('utf-8') + b'\n' for line in LINES)
+        body += json.dumps({'metrics': {}}).encode('utf-8') + b'\n'
+        self.assertEqual(self.stream(body), LINES)
+
+    def test_stream_without_metrics(self):
+        body = b''.join(json.dumps({'line': line}).encode('utf-8') + b'\n' for line in LINES)
+        with self.assertRaisesRegex(RuntimeError, "closed the stream early"):
+            self.stream(body)
+        self.assertEqual(self.lines, LINES)
+
+    def test_stream_cut_off_mid_message(self):
+        body = json.dumps({'line': LINES[0]}).encode('utf-8') + b'\n' + b'{"line": "02-Apr'
+        with self.assertRaisesRegex(RuntimeError, "closed the stream early"):
+            self.stream(body)
+        self.assertEqual(self.lines, LINES[:1])
+
+if __name__ == '__main__':
+    unittest.main()
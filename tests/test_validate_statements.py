@@ -0,0 +1,74 @@
+"""
+validate_statements must give exactly the records the per-line validator (validate_bank_lines)
+gives for each statement, in both money modes.
+
+Run with: python -m unittest tests.test_validate_statements
+"""
+import random
+import unittest
+
+import post_processing
+
+def _number(value, rng):
+    # Formatted like the statements, with the OCR damage clean_bank_lines lets through
+    text = f"{value:,.2f}"
+    r = rng.random()
+    if r < 0.05:
+        text = text.replace('.', ' ')[:-3]
+    elif r < 0.10:
+        text = text[:-3]
+    elif r < 0.13:
+        text = text.replace(',', ' ', 1)
+    return text
+
+def _statement(rng, rows):
+    balance = 0
+    lines = []
+    for _ in range(rows):
+        amount = round(rng.choice([rng.uniform(0, 1e4), rng.uniform(0, 3e6), 0.01, 0.005]), rng.choice([2, 2, 2, 3]))
+        balance = balance - amount if rng.random() < 0.5 else balance + amount
+        if rng.random() < 0.1:
+            # A misread balance, so some rows fail the check, including by less than a cent
+            balance += rng.choice([0.01, -0.01, 0.004, 1, 0.006])
+        lines.append(f"{rng.randint(1, 28):02d}-Apr-2023 Loan Recovery {rng.randint(1, 99999)} "
+                     f"{_number(amount, rng)} {_number(balance, rng)}")
+    return lines
+
+def _statements(seed=7, count=400):
+    rng = random.Random(seed)
+    return [_statement(rng, rng.randint(0, 60)) for _ in range(count)]
+
+class ValidateStatementsTest(unittest.TestCase):
+
+    def assert_matches_validator(self, statements, exact):
+        batch = post_processing.validate_statements(statements, exact=exact)
+        self.assertEqual(len(batch), sum(len(lines) for lines in statements))
+        failed = 0
+        for i, lines in enumerate(statements):
+            expected = list(post_processing.validate_bank_lines(lines, exact=exact))
+            self.assertEqual(batch.records(i), expected, f"statement {i}")
+            failed += sum(record['Status'] != "✅ OK" for record in expected)
+        self.assertEqual(batch.records(), [record for lines in statements
+                                           for record in post_processing.validate_bank_lines(lines, exact=exact)])
+        return failed
+
+    def test_float_mode(self):
+        # The generated statements must exercise the FALSE branch too
+        self.assertGreater(self.assert_matches_validator(_statements(), exact=False), 0)
+
+    def test_exact_mode(self):
+        self.assertGreater(self.assert_matches_validator(_statements(), exact=True), 0)
+
+    def test_numbers_beyond_int64(self):
+        # OCR running two numbers together overflows int64; exact mode keeps Python ints
+        statements = [["01-Apr-2023 Loan Recovery 1 99999999999999999999.00 -99999999999999999999.00",
+                       "02-Apr-2023 Loan Recovery 2 1.00 -99999999999999999998.00"]]
+        self.assert_matches_validator(statements, exact=True)
+        self.assert_matches_validator(statements, exact=False)
+
+    def test_empty(self):
+        self.assertEqual(post_processing.validate_statements([]).records(), [])
+        self.assert_matches_validator([[], ["01-Apr-2023 Loan Disbursement 5.00 -5.00"], []], exact=False)
+
+if __name__ == '__main__':
+    unittest.main()
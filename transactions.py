@@ -0,0 +1,233 @@
+"""
+Persistent store of every validated transaction, per user and account, for history and analytics.
+
+Rows are stored typed (ISO dates, integer minor units, debit/credit) and indexed so monthly
+totals, debit/credit summaries and date-range lookups read only the index entries they need.
+A transaction seen in two statements with overlapping periods is stored once: its fingerprint
+(date, amount, balance after it and description) is unique per user and account.
+"""
+import contextlib
+import hashlib
+import sqlite3
+import time
+
+import export
+import post_processing
+
+# Rows per INSERT transaction when storing a statement
+BATCH_ROWS = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    account TEXT NOT NULL DEFAULT '',
+    date TEXT,
+    description TEXT NOT NULL,
+    type TEXT,
+    amount_minor INTEGER,
+    balance_minor INTEGER,
+    status TEXT NOT NULL,
+    source TEXT,
+    fingerprint TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS transactions_fingerprint ON transactions (username, account, fingerprint);
+CREATE INDEX IF NOT EXISTS transactions_user_date ON transactions (username, date, type, amount_minor);
+CREATE INDEX IF NOT EXISTS transactions_account_date ON transactions (username, account, date, type, amount_minor);
+CREATE INDEX IF NOT EXISTS transactions_user_amount ON transactions (username, amount_minor);
+"""
+
+def fingerprint(row):
+    """Identity of a transaction across statements: date, amount, balance after it and description."""
+    description = " ".join(row['description'].lower().split())
+    key = f"{row['date']}|{row['amount_minor']}|{row['balance_minor']}|{description}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def _stored_row(row):
+    record = dict(row)
+    for name in ('amount_minor', 'balance_minor'):
+        value = record.pop(name)
+        record[name.replace('_minor', '')] = post_processing.format_minor_units(value) if value is not None else None
+        record[name] = value
+    return record
+
+class TransactionStore:
+    """SQLite table of validated transactions, shared by every web worker process."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _insert(self, username, account, source, records):
+        now = time.time()
+        values = []
+        for record in records:
+            row = export.typed_record(record)
+            row['date'] = row['date'].isoformat() if row['date'] else None
+            values.append((username, account, row['date'], row['description'], row['type'],
+                           row['amount_minor'], row['balance_minor'], row['status'], source,
+                           fingerprint(row), now))
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = conn.total_changes
+                # Rows already stored from an overlapping statement are skipped by the unique fingerprint
+                conn.executemany(
+                    "INSERT OR IGNORE INTO transactions (username, account, date, description, type, amount_minor, "
+                    "balance_minor, status, source, fingerprint, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    values
+                )
+                inserted = conn.total_changes - before
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return inserted
+
+    def stream_insert(self, records, username, account="", source=None, stats=None):
+        """
+        Stores validated records BATCH_ROWS at a time, one SQLite transaction per batch, and
+        passes each one on, so it can be chained with the CSV and export writers.
+
+        Args:
+            records (iterable): Validated records keyed by post_processing.OUTPUT_HEADERS
+            username (str): Owner of the statement
+            account (str): Account number, if known; deduplication is per user and account
+            source (str): Where the rows came from (job id or file name)
+            stats (dict): If given, receives 'stored' and 'duplicates' counts once the records run out
+
+        Yields:
+            dict: Each record, unchanged
+        """
+        pending = []
+        stored = total = 0
+        for record in records:
+            pending.append(record)
+            total += 1
+            yield record
+            if len(pending) >= BATCH_ROWS:
+                stored += self._insert(username, account, source, pending)
+                pending = []
+        if pending:
+            stored += self._insert(username, account, source, pending)
+        if stats is not None:
+            stats.update(stored=stored, duplicates=total - stored)
+        print(f"Stored {stored} transactions ({total - stored} already stored from overlapping statements)")
+
+    @staticmethod
+    def _filters(username, account, start, end):
+        clauses = ["username = ?"]
+        params = [username]
+        if account is not None:
+            clauses.append("account = ?")
+            params.append(account)
+        if start:
+            clauses.append("date >= ?")
+            params.append(start)
+        if end:
+            clauses.append("date <= ?")
+            params.append(end)
+        return " AND ".join(clauses), params
+
+    def monthly_totals(self, username, account=None, start=None, end=None):
+        """
+        Debit and credit totals per calendar month.
+
+        Args:
+            username (str): Owner of the transactions
+            account (str): Only this account (default: all of the user's accounts)
+            start (str): First date to include, YYYY-MM-DD
+            end (str): Last date to include, YYYY-MM-DD
+
+        Returns:
+            list: One dict per month (month, debits, credits, debit_minor, credit_minor), oldest first
+        """
+        where, params = self._filters(username, account, start, end)
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT substr(date, 1, 7) AS month, "
+                "SUM(type = 'debit') AS debits, SUM(type = 'credit') AS credits, "
+                "COALESCE(SUM(CASE WHEN type = 'debit' THEN amount_minor END), 0) AS debit_minor, "
+                "COALESCE(SUM(CASE WHEN type = 'credit' THEN amount_minor END), 0) AS credit_minor "
+                f"FROM transactions WHERE {where} AND date IS NOT NULL GROUP BY month ORDER BY month",
+                params
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def summary(self, username, account=None, start=None, end=None):
+        """
+        Count, total, average and largest amount of debits and of credits, and the dates covered.
+
+        Args:
+            Same as monthly_totals.
+
+        Returns:
+            dict: 'debit' and 'credit' (count, total_minor, average_minor, max_minor), first_date, last_date
+        """
+        where, params = self._filters(username, account, start, end)
+        result = {kind: {'count': 0, 'total_minor': 0, 'average_minor': None, 'max_minor': None}
+                  for kind in export.TYPES}
+        with self._connect() as conn:
+            for row in conn.execute(
+                    "SELECT type, COUNT(*) AS count, COALESCE(SUM(amount_minor), 0) AS total_minor, "
+                    "CAST(ROUND(AVG(amount_minor)) AS INTEGER) AS average_minor, MAX(amount_minor) AS max_minor "
+                    f"FROM transactions WHERE {where} AND type IS NOT NULL GROUP BY type", params):
+                result[row['type']] = {key: row[key] for key in ('count', 'total_minor', 'average_minor', 'max_minor')}
+            dates = conn.execute(f"SELECT MIN(date) AS first, MAX(date) AS last FROM transactions WHERE {where}",
+                                 params).fetchone()
+        result['first_date'] = dates['first']
+        result['last_date'] = dates['last']
+        return result
+
+    def in_range(self, username, start=None, end=None, account=None, min_amount=None, max_amount=None,
+                 after=None, limit=500):
+        """
+        Transactions between two dates, oldest first, a page at a time.
+
+        Args:
+            username (str): Owner of the transactions
+            start (str): First date to include, YYYY-MM-DD
+            end (str): Last date to include, YYYY-MM-DD
+            account (str): Only this account (default: all of the user's accounts)
+            min_amount (int): Smallest amount to include, in minor units
+            max_amount (int): Largest amount to include, in minor units
+            after (tuple): (date, id) of the last row of the previous page
+            limit (int): Rows per page
+
+        Returns:
+            tuple: (list of row dicts with formatted and minor-unit amounts, (date, id) cursor of
+                   the next page or None when this was the last one)
+        """
+        where, params = self._filters(username, account, start, end)
+        where += " AND date IS NOT NULL"
+        if min_amount is not None:
+            where += " AND amount_minor >= ?"
+            params.append(min_amount)
+        if max_amount is not None:
+            where += " AND amount_minor <= ?"
+            params.append(max_amount)
+        if after is not None:
+            # Keyset pagination: continues from the cursor through the date index instead of skipping OFFSET rows
+            where += " AND (date > ? OR (date = ? AND id > ?))"
+            params.extend([after[0], after[0], after[1]])
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, account, date, description, type, amount_minor, balance_minor, status, source "
+                f"FROM transactions WHERE {where} ORDER BY date, id LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        rows = [_stored_row(row) for row in rows]
+        cursor = (rows[-1]['date'], rows[-1]['id']) if len(rows) == limit else None
+        return rows, cursor